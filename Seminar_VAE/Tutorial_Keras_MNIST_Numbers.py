@@ -110,26 +110,20 @@ def plot_latent(encoder, decoder):
     digit_size = 28
     scale = 2.0
     figsize = 15
-    figure = np.zeros((digit_size * n, digit_size * n))
     # linearly spaced coordinates corresponding to the 2D plot
     # of digit classes in the latent space
     grid_x = np.linspace(-scale, scale, n)
     grid_y = np.linspace(-scale, scale, n)[::-1]
 
-    for i, yi in enumerate(grid_y):
-        for j, xi in enumerate(grid_x):
-            z_sample = np.array([[xi, yi]])
-            x_decoded = decoder.predict(z_sample)
-            digit = x_decoded[0].reshape(digit_size, digit_size)
-            figure[
-                i * digit_size : (i + 1) * digit_size,
-                j * digit_size : (j + 1) * digit_size,
-            ] = digit
+    # decode the whole grid in one batched call, row i holds grid_y[i] and column j grid_x[j]
+    z_samples = np.stack(np.meshgrid(grid_x, grid_y), axis=-1).reshape(n * n, 2)
+    x_decoded = decoder.predict(z_samples, batch_size=n * n)
+    # assemble the digits with one reshape/transpose instead of copying them one by one
+    figure = x_decoded.reshape(n, n, digit_size, digit_size).transpose(0, 2, 1, 3).reshape(
+        digit_size * n, digit_size * n)
 
     plt.figure(figsize=(figsize, figsize))
-    start_range = digit_size // 2
-    end_range = n * digit_size + start_range + 1
-    pixel_range = np.arange(start_range, end_range, digit_size)
+    pixel_range = np.arange(n) * digit_size + digit_size // 2
     sample_range_x = np.round(grid_x, 1)
     sample_range_y = np.round(grid_y, 1)
     plt.xticks(pixel_range, sample_range_x)
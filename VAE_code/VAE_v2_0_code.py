@@ -21,6 +21,8 @@ from sklearn.preprocessing import MinMaxScaler
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+from ecg5000_loader import load_ecg5000
+
 sns.set()
 
 """# Data Preprocessing
@@ -30,11 +32,11 @@ sns.set()
 ## Load Data
 """
 
-### Load ecg5000 data using read_csv
-ecg5000 = pd.read_csv('ECG5000_ALL.txt', sep='\s+', header=None)
+### Load ecg5000 data (text is only parsed on the first run, afterwards the float32 .npy cache is used)
+ecg5000_series, _ = load_ecg5000('ECG5000_ALL.txt')
 
-### Delete label-column first (column 0)
-ecg5000.drop(ecg5000.columns[[0]], axis=1, inplace=True)
+### Label-column (column 0) is returned separately, keep only the time series
+ecg5000 = pd.DataFrame(ecg5000_series)
 
 ### Optional test and info about data set
 print("Type of ecg5000: \t \t {}".format(type(ecg5000)))
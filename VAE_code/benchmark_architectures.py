@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the encoder and decoder architectures of create_encoder/create_decoder.
+
+Every combination of --encoders and --decoders is trained in a fresh process on the same ECG5000 split, reporting the
+number of parameters, the activation memory per sample, the peak RSS of the process, the training step time, the
+encoder inference throughput and the test reconstruction MSE.
+
+Usage:
+    python benchmark_architectures.py --data ../ECG5000/ECG5000_TRAIN.txt --epochs 10 --output architectures.json
+    python benchmark_architectures.py --encoders lstm tcn conv --decoders dense
+"""
+import argparse
+import json
+import multiprocessing
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+def activation_bytes(model, bytes_per_value=4):
+    """Sum of the output sizes of all layers of model for one sample, in bytes."""
+
+    total = 0
+    for layer in model.layers:
+        shapes = layer.output_shape if isinstance(layer.output_shape, list) else [layer.output_shape]
+        total += sum(int(np.prod(shape[1:])) for shape in shapes)
+    return total * bytes_per_value
+
+
+def run_architecture(encoder_type, decoder_type, data_path, epochs, batch_size):
+    """Trains a VAE with the given encoder/decoder types and returns its measurements (runs in a worker process)."""
+
+    import tensorflow as tf
+    from ecg5000_dataset import ECG5000Dataset
+    from vae_model import create_model
+
+    tf.random.set_seed(7)
+    dataset = ECG5000Dataset(data_path)
+    train_idx, test_idx = dataset.split(test_size=0.2, shuffle=True, random_state=1)
+    x_train, x_test = dataset.take(train_idx), dataset.take(test_idx)
+
+    start = time.time()
+    model = create_model(encoder_type=encoder_type, decoder_type=decoder_type)
+    build_time = time.time() - start
+    # first call traces the train function, do not count it as step time
+    model.fit(x_train[:batch_size], epochs=1, batch_size=batch_size, verbose=0)
+    start = time.time()
+    model.fit(x_train, epochs=epochs, batch_size=batch_size, verbose=0)
+    train_time = time.time() - start
+    n_steps = epochs * int(np.ceil(len(x_train) / batch_size))
+
+    # encoder throughput on the test split, after one warm up call
+    model.encoder.predict(x_test[:256], batch_size=256, verbose=0)
+    start = time.time()
+    z_mean, _, _ = model.encoder.predict(x_test, batch_size=256, verbose=0)
+    encode_time = time.time() - start
+    reconstruction = model.decoder.predict(z_mean, batch_size=256, verbose=0)
+
+    return {
+        'encoder_type': encoder_type,
+        'decoder_type': decoder_type,
+        'encoder_params': model.encoder.count_params(),
+        'decoder_params': model.decoder.count_params(),
+        'encoder_activation_bytes_per_sample': activation_bytes(model.encoder),
+        'decoder_activation_bytes_per_sample': activation_bytes(model.decoder),
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'build_time_s': build_time,
+        'step_time_ms': 1000 * train_time / n_steps,
+        'encode_samples_per_s': len(x_test) / encode_time,
+        'test_mse': float(np.mean(np.square(reconstruction - x_test))),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default='../ECG5000/ECG5000_TRAIN.txt', help='ECG5000 file to train on')
+    parser.add_argument('--encoders', nargs='+', default=['lstm', 'tcn', 'conv'])
+    parser.add_argument('--decoders', nargs='+', default=['dense', 'repeat', 'conv'])
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--output', default='architecture_benchmark.json', help='JSON file for the results')
+    args = parser.parse_args()
+
+    results = []
+    for encoder_type in args.encoders:
+        for decoder_type in args.decoders:
+            # fresh process per architecture, thus the peak RSS is not shared between the runs
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                results.append(executor.submit(run_architecture, encoder_type, decoder_type, args.data, args.epochs,
+                                               args.batch_size).result())
+
+    header = "{:<8} {:<8} {:>10} {:>14} {:>10} {:>10} {:>14} {:>10}".format(
+        'encoder', 'decoder', 'params', 'act. KB/sample', 'RSS MB', 'step ms', 'encode beats/s', 'test MSE')
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        print("{:<8} {:<8} {:>10} {:>14.1f} {:>10.1f} {:>10.2f} {:>14.1f} {:>10.4f}".format(
+            result['encoder_type'], result['decoder_type'], result['encoder_params'] + result['decoder_params'],
+            (result['encoder_activation_bytes_per_sample'] + result['decoder_activation_bytes_per_sample']) / 1024,
+            result['peak_rss_mb'], result['step_time_ms'], result['encode_samples_per_s'], result['test_mse']))
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""Benchmark suite of the training and inference hot paths of the ECG5000 VAE (offline, CPU only).
+
+For synthetic ECG5000-shaped data (generated heartbeats, written as ECG5000 text file) and optionally the real ECG5000
+file it measures:
+    - data load time of load_ecg5000, cold (parsing the text file, building the .npy cache) and warm (memory map)
+    - build time of create_model
+    - train_step throughput (samples/s, ms per step) for each of --batch-sizes
+    - latency (p50/p99) of encoder and decoder predict_on_batch for --predict-batch-size samples
+    - peak RSS, once per data set: every data set is benchmarked in a fresh process, the peak RSS of a process only
+      grows, thus it cannot be attributed to single sections
+The results are written to a JSON file. With --compare the results are checked against an earlier JSON file, every
+timing which got slower by more than --tolerance is reported and the script exits with status 1. p99 latencies are
+reported but not compared, with a few hundred calls they are too noisy for a fixed tolerance.
+
+Usage:
+    python benchmark_vae.py --output bench.json
+    python benchmark_vae.py --data ../ECG5000/ECG5000_TRAIN.txt --encoder-type tcn --compare bench.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# CPU only, also on machines with a GPU, thus the numbers are comparable
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')
+
+import numpy as np
+import tensorflow as tf
+
+from ecg5000_loader import load_ecg5000
+from vae_model import create_model
+
+# metrics compared by --compare, True if higher is better (p99_ms is left out, it is the 2nd slowest of 200 calls)
+COMPARED_METRICS = {'load_cold_s': False, 'load_warm_s': False, 'build_s': False, 'samples_per_s': True,
+                    'p50_ms': False}
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def synthetic_ecg(n_samples, series_length=140, seed=0):
+    """Heartbeat-like series (P wave, QRS complex, T wave as gaussian bumps with jitter and noise), z-normalized."""
+
+    rng = np.random.default_rng(seed)
+    t = np.linspace(0, 1, series_length)
+    waves = [(0.15, 0.2, 0.03), (0.35, -0.3, 0.01), (0.4, 2.5, 0.012), (0.45, -0.6, 0.01), (0.7, 0.5, 0.05)]
+    x = np.zeros((n_samples, series_length))
+    for position, amplitude, width in waves:
+        shift = rng.normal(0, 0.02, size=(n_samples, 1))
+        scale = rng.normal(1, 0.1, size=(n_samples, 1))
+        x += amplitude * scale * np.exp(-((t - position - shift) ** 2) / (2 * width ** 2))
+    x += rng.normal(0, 0.05, size=x.shape)
+    return (x - x.mean(axis=1, keepdims=True)) / x.std(axis=1, keepdims=True)
+
+
+def bench_load(path):
+    """Returns (x with feature axis, timings) of loading path without and with the .npy cache."""
+
+    cache_dir = tempfile.mkdtemp(prefix='bench_cache_')
+    try:
+        start = time.perf_counter()
+        load_ecg5000(path, cache_dir=cache_dir)
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        series, _ = load_ecg5000(path, cache_dir=cache_dir)
+        x = np.array(series[:, :, np.newaxis])
+        warm = time.perf_counter() - start
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return x, {'samples': len(x), 'load_cold_s': cold, 'load_warm_s': warm}
+
+
+def bench_train(model, x, batch_sizes, steps):
+    """train_step throughput per batch size, steps batches after one warm up fit (tracing)."""
+
+    results = {}
+    for batch_size in batch_sizes:
+        n = batch_size * steps
+        x_steps = np.resize(x, (n,) + x.shape[1:]).astype(np.float32)
+        model.fit(x_steps[:batch_size], batch_size=batch_size, epochs=1, verbose=0)
+        start = time.perf_counter()
+        model.fit(x_steps, batch_size=batch_size, epochs=1, shuffle=False, verbose=0)
+        elapsed = time.perf_counter() - start
+        results[str(batch_size)] = {'samples_per_s': n / elapsed, 'step_ms': 1000 * elapsed / steps}
+    return results
+
+
+def bench_latency(predict, inputs, repeats):
+    """p50/p99 latency in ms of predict(inputs) over repeats calls after a warm up call."""
+
+    predict(inputs)
+    times = np.empty(repeats)
+    for i in range(repeats):
+        start = time.perf_counter()
+        predict(inputs)
+        times[i] = time.perf_counter() - start
+    return {'p50_ms': 1000 * float(np.percentile(times, 50)), 'p99_ms': 1000 * float(np.percentile(times, 99))}
+
+
+def bench_dataset(path, args):
+    """Runs all benchmarks on the ECG5000 file path (call it in a fresh process, see run_isolated)."""
+
+    x, load = bench_load(path)
+    tf.random.set_seed(1)
+    start = time.perf_counter()
+    model = create_model(encoder_type=args.encoder_type, decoder_type=args.decoder_type)
+    build = {'build_s': time.perf_counter() - start}
+    train = bench_train(model, x, args.batch_sizes, args.steps)
+    x_batch = np.resize(x, (args.predict_batch_size,) + x.shape[1:]).astype(np.float32)
+    z_batch = model.encoder.predict_on_batch(x_batch)[2]
+    return {
+        'load': load,
+        'build': build,
+        'train': train,
+        'encoder_predict': bench_latency(model.encoder.predict_on_batch, x_batch, args.repeats),
+        'decoder_predict': bench_latency(model.decoder.predict_on_batch, z_batch, args.repeats),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run_isolated(path, args):
+    """bench_dataset in a fresh process, thus its peak RSS and warm up do not depend on earlier data sets."""
+
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(bench_dataset, path, args).result()
+
+
+def compare(results, baseline, tolerance, prefix=''):
+    """Returns the (name, baseline, current) of all compared metrics which regressed by more than tolerance."""
+
+    regressions = []
+    for key, value in results.items():
+        if key not in baseline:
+            continue
+        name = prefix + key
+        if isinstance(value, dict):
+            regressions += compare(value, baseline[key], tolerance, prefix=name + '.')
+        elif key in COMPARED_METRICS and baseline[key]:
+            change = value / baseline[key] - 1
+            if (-change if COMPARED_METRICS[key] else change) > tolerance:
+                regressions.append((name, baseline[key], value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default=None, help='real ECG5000 file, benchmarked in addition to synthetic data')
+    parser.add_argument('--synthetic-samples', type=int, default=5000)
+    parser.add_argument('--encoder-type', default='lstm')
+    parser.add_argument('--decoder-type', default='dense')
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[16, 64, 256])
+    parser.add_argument('--steps', type=int, default=20, help='timed train steps per batch size')
+    parser.add_argument('--predict-batch-size', type=int, default=1)
+    parser.add_argument('--repeats', type=int, default=200, help='timed predict calls')
+    parser.add_argument('--output', default='benchmark_vae.json', help='JSON file for the results')
+    parser.add_argument('--compare', default=None, help='JSON file of an earlier run to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative slowdown for --compare')
+    args = parser.parse_args()
+
+    results = {
+        'config': dict(vars(args), tensorflow=tf.__version__, python=platform.python_version(),
+                       cpu_count=os.cpu_count(), machine=platform.machine()),
+        'datasets': {},
+    }
+    tmp_dir = tempfile.mkdtemp(prefix='bench_data_')
+    try:
+        # synthetic data in the ECG5000 text format (label in the first column)
+        synthetic_path = os.path.join(tmp_dir, 'synthetic_ECG5000.txt')
+        x = synthetic_ecg(args.synthetic_samples)
+        np.savetxt(synthetic_path, np.column_stack([np.ones(len(x)), x]), fmt='%.8e')
+        results['datasets']['synthetic'] = run_isolated(synthetic_path, args)
+        if args.data:
+            results['datasets']['ecg5000'] = run_isolated(args.data, args)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(json.dumps(results['datasets'], indent=2))
+
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            baseline = json.load(file)
+        regressions = compare(results['datasets'], baseline['datasets'], args.tolerance)
+        for name, before, after in regressions:
+            print("REGRESSION {}: {:.4g} -> {:.4g}".format(name, before, after))
+        if regressions:
+            sys.exit(1)
+        print("No regression above {:.0%}".format(args.tolerance))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""Data parallel training of the VAE with tf.distribute.MultiWorkerMirroredStrategy on CPU workers.
+
+Every worker is one process (on one or several hosts) holding a replica of the model. The global batch is split over
+the workers, the gradients are all-reduced (summed) and VAE.train_step scales each replica's loss by its share of the
+global batch, so the update equals single process training with the global batch size.
+
+With --workers 1 2 4 the script starts that many local worker processes (ports on localhost) for each setting, trains
+for --epochs with a fixed per worker batch size and reports samples/s and the scaling efficiency
+(throughput with n workers / (n * throughput with 1 worker)). For several hosts, start the script with --worker-index
+on every host and a common --hosts list instead.
+
+Usage:
+    python distributed_training.py --data ../ECG5000/ECG5000_TRAIN.txt --workers 1 2 4 --epochs 3
+    python distributed_training.py --hosts node1:12345 node2:12345 --worker-index 0 --epochs 100
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import socket
+import time
+
+
+def free_ports(n):
+    """Returns n free TCP ports on localhost."""
+
+    sockets = [socket.socket() for _ in range(n)]
+    for s in sockets:
+        s.bind(('localhost', 0))
+    ports = [s.getsockname()[1] for s in sockets]
+    for s in sockets:
+        s.close()
+    return ports
+
+
+def run_worker(hosts, worker_index, data_path, epochs, batch_size, threads_per_worker=None, results=None):
+    """Trains the VAE as worker worker_index of hosts, worker 0 puts its measurements into the queue results."""
+
+    # TF_CONFIG has to be set before TensorFlow creates the strategy
+    os.environ['TF_CONFIG'] = json.dumps({'cluster': {'worker': list(hosts)},
+                                          'task': {'type': 'worker', 'index': worker_index}})
+    if threads_per_worker:
+        os.environ['OMP_NUM_THREADS'] = str(threads_per_worker)
+    import tensorflow as tf
+    from ecg5000_dataset import ECG5000Dataset
+    from vae_model import create_model
+
+    if threads_per_worker:
+        tf.config.threading.set_intra_op_parallelism_threads(threads_per_worker)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    strategy = tf.distribute.MultiWorkerMirroredStrategy()
+    n_workers = strategy.num_replicas_in_sync
+    global_batch_size = batch_size * n_workers
+
+    tf.random.set_seed(7)
+    dataset = ECG5000Dataset(data_path)
+    train_idx, _ = dataset.split(test_size=0.2, shuffle=True, random_state=1)
+    x_train = dataset.take(train_idx)
+    # every worker reads the same dataset, the strategy hands each one its share of every global batch
+    train_ds = tf.data.Dataset.from_tensor_slices(x_train).shuffle(len(x_train), seed=1).batch(
+        global_batch_size, drop_remainder=True)
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.DATA
+    train_ds = train_ds.with_options(options)
+
+    model = create_model(strategy=strategy)
+    # first epoch traces the train function and sets up the collectives, do not count it
+    model.fit(train_ds, epochs=1, verbose=0)
+    start = time.time()
+    history = model.fit(train_ds, epochs=epochs, verbose=0)
+    train_time = time.time() - start
+    n_samples = epochs * (len(x_train) // global_batch_size) * global_batch_size
+
+    if worker_index == 0 and results is not None:
+        results.put({
+            'workers': n_workers,
+            'global_batch_size': global_batch_size,
+            'samples_per_s': n_samples / train_time,
+            'loss': float(history.history['loss'][-1]),
+            'reconstruction_loss': float(history.history['reconstruction_loss'][-1]),
+            'kl_loss': float(history.history['kl_loss'][-1]),
+        })
+
+
+def run_local(n_workers, data_path, epochs, batch_size, threads_per_worker=None):
+    """Runs n_workers local worker processes and returns the measurements of worker 0."""
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    hosts = ['localhost:{}'.format(port) for port in free_ports(n_workers)]
+    processes = [context.Process(target=run_worker, args=(hosts, i, data_path, epochs, batch_size,
+                                                          threads_per_worker, results))
+                 for i in range(n_workers)]
+    for process in processes:
+        process.start()
+    # wait for the result of worker 0, a crashed worker would leave the others (and get) waiting forever
+    while True:
+        try:
+            result = results.get(timeout=1)
+            break
+        except queue.Empty:
+            failed = [(i, process.exitcode) for i, process in enumerate(processes) if process.exitcode]
+            if failed or all(process.exitcode == 0 for process in processes):
+                for process in processes:
+                    process.terminate()
+                    process.join()
+                raise RuntimeError("Worker {} exited with code {} before the result of worker 0 was received".format(
+                    *(failed[0] if failed else (0, 0))))
+    for process in processes:
+        process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default='../ECG5000/ECG5000_TRAIN.txt', help='ECG5000 file to train on')
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 2], help='local worker counts to compare')
+    parser.add_argument('--hosts', nargs='+', default=None, help='host:port of all workers (multi-host mode)')
+    parser.add_argument('--worker-index', type=int, default=0, help='index of this host in --hosts')
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=16, help='batch size per worker')
+    parser.add_argument('--threads-per-worker', type=int, default=None)
+    parser.add_argument('--output', default=None, help='JSON file for the results')
+    args = parser.parse_args()
+
+    if args.hosts:
+        run_worker(args.hosts, args.worker_index, args.data, args.epochs, args.batch_size, args.threads_per_worker)
+        return
+
+    threads_per_worker = args.threads_per_worker
+    results = []
+    for n_workers in args.workers:
+        if args.threads_per_worker is None:
+            # share the cores of this machine between the local workers
+            threads_per_worker = max(1, (os.cpu_count() or 1) // n_workers)
+        results.append(run_local(n_workers, args.data, args.epochs, args.batch_size, threads_per_worker))
+
+    baseline = next((r['samples_per_s'] for r in results if r['workers'] == 1), None)
+    print("{:>8} {:>12} {:>12} {:>11} {:>10}".format('workers', 'global batch', 'samples/s', 'efficiency', 'loss'))
+    for result in results:
+        result['scaling_efficiency'] = (result['samples_per_s'] / (result['workers'] * baseline)
+                                        if baseline else None)
+        print("{:>8} {:>12} {:>12.1f} {:>11} {:>10.4f}".format(
+            result['workers'], result['global_batch_size'], result['samples_per_s'],
+            '{:.2f}'.format(result['scaling_efficiency']) if baseline else '-', result['loss']))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Memory-mapped ECG5000 dataset for training the VAE.
+
+All series live in one read-only np.memmap of shape (samples, time steps, 1) in float32, the labels are kept
+separately. Train/test splits are index arrays over that buffer, samples are only copied into memory by take (or
+gathered batch by batch by their users, e.g. latent_export.export_predictions), so peak memory stays at about one copy
+of the data.
+
+For data sets larger than RAM the series can also be written to sharded raw float32 files, which make_vae_dataset
+streams through a tf.data pipeline (bounded shuffle buffer, batching, optional cache and prefetch).
+"""
+import glob
+import math
+import os
+
+import numpy as np
+import tensorflow as tf
+from sklearn.model_selection import train_test_split
+
+from ecg5000_loader import load_ecg5000
+
+
+class ECG5000Dataset:
+    """ECG5000 series backed by one memory-mapped float32 buffer, labels stored separately."""
+
+    def __init__(self, path, cache_dir=None):
+        series, self.y = load_ecg5000(path, cache_dir=cache_dir, mmap_mode='r')
+        # add the feature axis as a view, the buffer stays memory-mapped
+        self.x = series[:, :, np.newaxis]
+
+    def __len__(self):
+        return len(self.y)
+
+    @property
+    def shape(self):
+        return self.x.shape
+
+    def split(self, test_size=0.2, shuffle=True, random_state=1):
+        """Splits the sample indices into (train_idx, test_idx), same split as train_test_split on the data."""
+
+        return train_test_split(np.arange(len(self)), test_size=test_size, shuffle=shuffle,
+                                random_state=random_state)
+
+    def take(self, indices):
+        """Copies the samples at indices into memory, only needed for APIs which require in-memory arrays."""
+
+        return np.asarray(self.x[indices])
+
+
+def write_shards(x, out_dir, indices=None, shard_size=100000, prefix='ecg5000'):
+    """Writes the samples of x (at indices) to raw little-endian float32 shard files, returns the file paths."""
+
+    if indices is None:
+        indices = np.arange(len(x))
+    os.makedirs(out_dir, exist_ok=True)
+    # remove old shards, otherwise a smaller split would leave stale files behind
+    for path in glob.glob(os.path.join(out_dir, prefix + '-*.f32')):
+        os.remove(path)
+    paths = []
+    for shard, start in enumerate(range(0, len(indices), shard_size)):
+        path = os.path.join(out_dir, '{}-{:05d}.f32'.format(prefix, shard))
+        np.asarray(x[indices[start:start + shard_size]], dtype='<f4').tofile(path)
+        paths.append(path)
+    return paths
+
+
+def make_vae_dataset(file_pattern, batch_size=16, series_length=140, shuffle_buffer=10000, cache=False, seed=None,
+                     drop_remainder=False):
+    """Builds a tf.data pipeline streaming the shards matching file_pattern, yielding only x for VAE.fit.
+
+    shuffle_buffer bounds the number of samples held for shuffling (0 disables shuffling). cache=True keeps the raw
+    samples in memory after the first epoch, a string caches them to that file instead. The number of batches is set
+    from the shard sizes, thus fit knows the epoch length (needed with steps_per_execution > 1).
+    """
+
+    record_bytes = series_length * 4
+    n_samples = sum(tf.io.gfile.stat(path).length // record_bytes for path in tf.io.gfile.glob(file_pattern))
+    n_batches = n_samples // batch_size if drop_remainder else math.ceil(n_samples / batch_size)
+    shuffle = shuffle_buffer > 0
+    files = tf.data.Dataset.list_files(file_pattern, shuffle=shuffle, seed=seed)
+    # read several shards in parallel when shuffling, otherwise keep the sample order of the shards
+    dataset = files.interleave(lambda path: tf.data.FixedLengthRecordDataset(path, record_bytes),
+                               cycle_length=None if shuffle else 1, num_parallel_calls=tf.data.AUTOTUNE,
+                               deterministic=not shuffle)
+    if cache:
+        dataset = dataset.cache() if cache is True else dataset.cache(cache)
+    if shuffle:
+        dataset = dataset.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size, drop_remainder=drop_remainder)
+    # interleave over FixedLengthRecordDatasets has an unknown cardinality
+    dataset = dataset.apply(tf.data.experimental.assert_cardinality(n_batches))
+    # decode the whole batch of raw records at once
+    dataset = dataset.map(lambda records: tf.reshape(tf.io.decode_raw(records, tf.float32), (-1, series_length, 1)),
+                          num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
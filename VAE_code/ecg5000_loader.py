@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""Loader for the ECG5000 data set with a binary float32 cache.
+
+The text variants in ECG5000/ (whitespace separated .txt/.csv, .arff and .ts) are parsed only once. Afterwards the
+series and labels are kept as .npy files keyed by the hash of the source file, so later loads just memory-map the
+cache instead of parsing text again.
+"""
+import hashlib
+import os
+
+import numpy as np
+
+### Bump if the layout of the cache files changes, old caches are then ignored
+CACHE_VERSION = 1
+
+### Number of text rows converted at once, keeps the parse memory bounded for large files
+CHUNK_ROWS = 4096
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """Returns the sha1 hex digest of a file, read in chunks."""
+
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def _file_format(path):
+    """Maps the file extension to one of the supported ECG5000 formats ('txt', 'arff', 'ts')."""
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.txt', '.csv'):
+        return 'txt'
+    if extension in ('.arff', '.ts'):
+        return extension[1:]
+    raise ValueError("Unsupported ECG5000 file format: {}".format(path))
+
+
+def _data_lines(path, fmt):
+    """Yields the non-empty data lines of a file, skipping the header of .arff and .ts files."""
+
+    in_data = fmt == 'txt'
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            if in_data:
+                yield line
+            elif line.lower().startswith('@data'):
+                in_data = True
+
+
+def _parse_rows(lines, fmt):
+    """Converts a list of data lines into (series, labels)."""
+
+    text = ' '.join(lines)
+    if fmt != 'txt':
+        # .arff separates values by ',' and .ts additionally separates the label by ':'
+        text = text.replace(',', ' ').replace(':', ' ')
+    rows = np.array(text.split(), dtype=np.float64).reshape(len(lines), -1)
+    # label is the first column in .txt/.csv and the last column in .arff/.ts
+    if fmt == 'txt':
+        return rows[:, 1:], rows[:, 0]
+    return rows[:, :-1], rows[:, -1]
+
+
+def _chunks(lines, size):
+    """Groups an iterable of lines into lists of at most size lines."""
+
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def cache_paths(path, cache_dir=None):
+    """Returns the (series, labels) .npy cache paths of an ECG5000 file."""
+
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), '.ecg5000_cache')
+    key = "{}.v{}.{}".format(os.path.basename(path), CACHE_VERSION, file_hash(path)[:16])
+    return os.path.join(cache_dir, key + '.x.npy'), os.path.join(cache_dir, key + '.y.npy')
+
+
+def build_cache(path, x_path, y_path):
+    """Parses an ECG5000 file chunk by chunk into the float32 series cache and the int labels cache."""
+
+    fmt = _file_format(path)
+    n_rows = sum(1 for _ in _data_lines(path, fmt))
+    first_series, _ = _parse_rows(next(_chunks(_data_lines(path, fmt), 1)), fmt)
+    n_steps = first_series.shape[1]
+
+    os.makedirs(os.path.dirname(x_path), exist_ok=True)
+    # write to temporary files first, so that a killed parse never leaves a broken cache behind
+    x_tmp, y_tmp = x_path + '.tmp', y_path + '.tmp'
+    x = np.lib.format.open_memmap(x_tmp, mode='w+', dtype=np.float32, shape=(n_rows, n_steps))
+    y = np.lib.format.open_memmap(y_tmp, mode='w+', dtype=np.int64, shape=(n_rows,))
+    start = 0
+    for chunk in _chunks(_data_lines(path, fmt), CHUNK_ROWS):
+        series, labels = _parse_rows(chunk, fmt)
+        x[start:start + len(chunk)] = series
+        y[start:start + len(chunk)] = labels
+        start += len(chunk)
+    x.flush()
+    y.flush()
+    del x, y
+    os.replace(x_tmp, x_path)
+    os.replace(y_tmp, y_path)
+
+
+def load_ecg5000(path, cache_dir=None, mmap_mode='r'):
+    """Loads an ECG5000 file as (series, labels), series of shape (samples, time steps) in float32.
+
+    The text is only parsed if no cache for the current file hash exists, otherwise the cached .npy files are loaded
+    (memory-mapped unless mmap_mode is None).
+    """
+
+    x_path, y_path = cache_paths(path, cache_dir=cache_dir)
+    if not (os.path.exists(x_path) and os.path.exists(y_path)):
+        build_cache(path, x_path, y_path)
+    return np.load(x_path, mmap_mode=mmap_mode), np.load(y_path, mmap_mode=mmap_mode)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Successive halving / Hyperband search over the hyperparameters of create_model.
+
+All candidates are trained for a small epoch budget, then only the best 1/eta of them (by validation reconstruction
+loss) are promoted and trained further, until max_epochs are reached. Diverging candidates are stopped on the first
+nan loss and dropped at the next rung, so most of the compute goes to the promising configurations.
+"""
+import math
+
+import numpy as np
+from tensorflow import keras
+from sklearn.model_selection import ParameterSampler
+
+from parallel_search import split_params
+from scoring import score_mse
+
+
+def validation_loss(model, x_val, batch_size=256):
+    """Reconstruction MSE of x_val using z_mean (no sampling), inf if the model diverged."""
+
+    _, _, z = model.encode(x_val, batch_size=batch_size, deterministic=True)
+    reconstruction = model.decoder.predict(z, batch_size=batch_size, verbose=0)
+    loss = float(score_mse(x_val, reconstruction))
+    return loss if np.isfinite(loss) else np.inf
+
+
+class SuccessiveHalvingSearch:
+    """Successive halving over candidates drawn from param_distributions (like RandomizedSearchCV).
+
+    Rung r trains the surviving candidates up to min_epochs * eta**r epochs (continuing from the previous rung) and
+    keeps the best ceil(n / eta). With hyperband=True several brackets trade off the number of candidates against the
+    starting budget, n_candidates is then the size of the most aggressive bracket.
+    """
+
+    def __init__(self, build_fn, param_distributions, n_candidates=27, min_epochs=1, max_epochs=27, eta=3,
+                 hyperband=False, validation_split=0.2, fit_defaults=None, random_state=1, verbose=0):
+        self.build_fn = build_fn
+        self.param_distributions = param_distributions
+        self.n_candidates = n_candidates
+        self.min_epochs = min_epochs
+        self.max_epochs = max_epochs
+        self.eta = eta
+        self.hyperband = hyperband
+        self.validation_split = validation_split
+        self.fit_defaults = dict(fit_defaults or {'verbose': 0})
+        self.random_state = random_state
+        self.verbose = verbose
+
+    def _brackets(self):
+        """Returns the (n_candidates, min_epochs) of each bracket."""
+
+        # counted in integers, math.log(243, 3) is 4.999... and int() would drop the full budget rung
+        n_rungs, budget = 1, self.min_epochs * self.eta
+        while budget <= self.max_epochs:
+            n_rungs, budget = n_rungs + 1, budget * self.eta
+        if not self.hyperband:
+            return [(self.n_candidates, self.min_epochs)]
+        # Hyperband: from many candidates with a small budget to few candidates with the full budget
+        return [(max(1, int(self.n_candidates / self.eta ** s)), self.min_epochs * self.eta ** s)
+                for s in range(n_rungs)]
+
+    def _run_bracket(self, candidates, min_epochs, x_train, x_val, bracket):
+        """Trains one bracket of candidates with successive halving, returns the surviving (model, params)."""
+
+        models = {}
+        survivors = list(range(len(candidates)))
+        epochs, done = min_epochs, 0
+        while True:
+            losses = {}
+            for i in survivors:
+                build_params, fit_params = split_params(self.build_fn, candidates[i])
+                if i not in models:
+                    models[i] = self.build_fn(**build_params)
+                # the epoch budget is set by the rung
+                fit_params = dict(self.fit_defaults, **fit_params)
+                fit_params.pop('epochs', None)
+                models[i].fit(x_train, x_train, epochs=epochs, initial_epoch=done,
+                              callbacks=[keras.callbacks.TerminateOnNaN()], **fit_params)
+                losses[i] = validation_loss(models[i], x_val)
+                self.total_epochs_ += epochs - done
+                self.history_.append({'bracket': bracket, 'candidate': i, 'params': candidates[i], 'epochs': epochs,
+                                      'val_loss': losses[i]})
+                if self.verbose:
+                    print("[bracket {}, {} epochs] candidate {}: {}, val_loss={:.4f}".format(
+                        bracket, epochs, i, candidates[i], losses[i]))
+            if epochs >= self.max_epochs:
+                break
+            # promote the best 1/eta, the models of all other candidates are dropped
+            n_keep = max(1, math.ceil(len(survivors) / self.eta))
+            survivors = sorted(survivors, key=lambda i: losses[i])[:n_keep]
+            for i in list(models):
+                if i not in survivors:
+                    del models[i]
+            done, epochs = epochs, min(epochs * self.eta, self.max_epochs)
+        best = min(survivors, key=lambda i: losses[i])
+        return models[best], candidates[best], losses[best]
+
+    def fit(self, x):
+        """Runs the search on x (input is also the target), holding out validation_split of x for the ranking."""
+
+        rng = np.random.default_rng(self.random_state)
+        indices = rng.permutation(len(x))
+        n_val = int(len(x) * self.validation_split)
+        x_val, x_train = np.asarray(x[np.sort(indices[:n_val])]), np.asarray(x[np.sort(indices[n_val:])])
+
+        self.history_ = []
+        self.total_epochs_ = 0
+        best_loss = np.inf
+        for bracket, (n_candidates, min_epochs) in enumerate(self._brackets()):
+            candidates = list(ParameterSampler(self.param_distributions, n_candidates,
+                                               random_state=self.random_state + bracket))
+            model, params, loss = self._run_bracket(candidates, min_epochs, x_train, x_val, bracket)
+            if loss < best_loss or bracket == 0:
+                best_loss, self.best_estimator_, self.best_params_ = loss, model, params
+        # negative loss, so that greater is better as for the scores of RandomizedSearchCV
+        self.best_score_ = -best_loss
+        return self
+
+    def predict(self, x):
+        return self.best_estimator_.predict(x)
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""Export of a trained encoder/decoder to a frozen inference-only artifact.
+
+export_saved_model writes a SavedModel with three concrete signatures (fixed input shapes, by default any batch size):
+    encode(x: float32[None, 140, 1])       -> z_mean, z_log_var
+    decode(z: float32[None, latent_dim])   -> reconstruction
+    reconstruct(x: float32[None, 140, 1])  -> reconstruction (decoded from z_mean), mse, kl (per beat)
+It is loaded with tf.saved_model.load alone, neither Keras nor the VAE/Sampling classes are needed, and it contains no
+training state (optimizer, sampling noise, dropout). export_tflite converts these signatures (with a static batch size)
+to one TFLite flatbuffer, which InferenceModel loads with tflite_runtime if installed (small, no TensorFlow import) and
+tf.lite otherwise.
+
+Usage:
+    python inference_export.py --model vae_model --output vae_inference --tflite vae.tflite
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+SIGNATURES = ('encode', 'decode', 'reconstruct')
+
+
+def export_saved_model(encoder, decoder, directory, batch_size=None):
+    """Writes the encode/decode/reconstruct signatures of encoder and decoder as SavedModel to directory.
+
+    batch_size fixes the batch dimension of the signatures (None: any batch size).
+    """
+
+    import tensorflow as tf
+    from tensorflow.python.framework.convert_to_constants import convert_variables_to_constants_v2
+
+    series_length, latent_dim = encoder.input_shape[1], decoder.input_shape[1]
+    x_spec = tf.TensorSpec((batch_size, series_length, 1), tf.float32, name='x')
+    z_spec = tf.TensorSpec((batch_size, latent_dim), tf.float32, name='z')
+
+    def encode(x):
+        z_mean, z_log_var, _ = encoder(x, training=False)
+        return {'z_mean': z_mean, 'z_log_var': z_log_var}
+
+    def decode(z):
+        return {'reconstruction': tf.cast(decoder(z, training=False), tf.float32)}
+
+    def reconstruct(x):
+        z_mean, z_log_var, _ = encoder(x, training=False)
+        reconstruction = tf.cast(decoder(z_mean, training=False), tf.float32)
+        mse = tf.reduce_mean(tf.math.squared_difference(x, reconstruction), axis=[1, 2])
+        kl = -0.5 * tf.reduce_mean(1 + z_log_var - tf.square(z_mean) - tf.exp(z_log_var), axis=1)
+        return {'reconstruction': reconstruction, 'mse': mse, 'kl': kl}
+
+    def frozen_signature(function, spec):
+        # the weights are folded into the graph as constants, thus the SavedModel holds neither variables nor the
+        # Keras objects and loading it only restores the graphs of the signatures
+        concrete = tf.function(function).get_concrete_function(spec)
+        frozen = convert_variables_to_constants_v2(concrete)
+        # the frozen function returns a flat list (in the order of the sorted output names), restore the names
+        names = sorted(concrete.structured_outputs)
+        return tf.function(lambda inputs: dict(zip(names, frozen(inputs))), input_signature=[spec])
+
+    signatures = {'encode': frozen_signature(encode, x_spec), 'decode': frozen_signature(decode, z_spec),
+                  'reconstruct': frozen_signature(reconstruct, x_spec)}
+    tf.saved_model.save(tf.Module(), directory, signatures=signatures)
+    return directory
+
+
+def export_tflite(encoder, decoder, path, batch_size=1, optimizations=None, representative_dataset=None, int8=False):
+    """Converts the signatures of encoder and decoder to a TFLite file, returns its size in bytes.
+
+    The TFLite converter only fuses the LSTMs into TFLite kernels for a static batch size, thus the signatures take
+    batches of exactly batch_size beats (InferenceModel splits and pads larger inputs). optimizations,
+    representative_dataset and int8 configure post-training quantization, see quantize_vae.py.
+    """
+
+    import tensorflow as tf
+
+    saved_model_dir = tempfile.mkdtemp(prefix='vae_tflite_')
+    try:
+        export_saved_model(encoder, decoder, saved_model_dir, batch_size=batch_size)
+        converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir, signature_keys=list(SIGNATURES))
+        flatbuffer = _convert(converter, optimizations, representative_dataset, int8)
+    finally:
+        shutil.rmtree(saved_model_dir, ignore_errors=True)
+    with open(path, 'wb') as file:
+        file.write(flatbuffer)
+    return len(flatbuffer)
+
+
+def _convert(converter, optimizations, representative_dataset, int8):
+    import tensorflow as tf
+
+    if optimizations:
+        converter.optimizations = optimizations
+    if representative_dataset is not None:
+        converter.representative_dataset = representative_dataset
+    if int8:
+        # integer kernels where available, float kernels for the remaining ops (e.g. parts of the LSTMs)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8, tf.lite.OpsSet.TFLITE_BUILTINS]
+    return converter.convert()
+
+
+def _tflite_interpreter(path, num_threads=None):
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter(model_path=path, num_threads=num_threads)
+
+
+class InferenceModel:
+    """encode/decode/reconstruct of an exported SavedModel directory or .tflite file, inputs and outputs are numpy."""
+
+    def __init__(self, path, num_threads=None):
+        self.path = path
+        if path.endswith('.tflite'):
+            interpreter = _tflite_interpreter(path, num_threads=num_threads)
+            self._runners = {name: interpreter.get_signature_runner(name) for name in SIGNATURES}
+            self._convert = lambda value: value
+            # static batch size of the TFLite signatures
+            self.batch_size = int(self._runners['encode'].get_input_details()['x']['shape'][0])
+        else:
+            import tensorflow as tf
+
+            loaded = tf.saved_model.load(path)
+            self._loaded = loaded
+            self._runners = {name: loaded.signatures[name] for name in SIGNATURES}
+            self._convert = tf.convert_to_tensor
+            self.batch_size = None
+
+    def _run(self, name, **inputs):
+        import numpy as np
+
+        inputs = {key: np.asarray(value, dtype=np.float32) for key, value in inputs.items()}
+        if self.batch_size is None:
+            outputs = self._runners[name](**{key: self._convert(value) for key, value in inputs.items()})
+            return {key: np.asarray(value) for key, value in outputs.items()}
+        # static batch size: run in chunks of batch_size, the last one padded with zeros
+        n = len(next(iter(inputs.values())))
+        chunks = []
+        for start in range(0, n, self.batch_size):
+            chunk = {}
+            for key, value in inputs.items():
+                value = value[start:start + self.batch_size]
+                padding = [(0, self.batch_size - len(value))] + [(0, 0)] * (value.ndim - 1)
+                chunk[key] = np.pad(value, padding)
+            chunks.append(self._runners[name](**chunk))
+        return {key: np.concatenate([chunk[key] for chunk in chunks])[:n] for key in chunks[0]}
+
+    def encode(self, x):
+        return self._run('encode', x=x)
+
+    def decode(self, z):
+        return self._run('decode', z=z)['reconstruction']
+
+    def reconstruct(self, x):
+        return self._run('reconstruct', x=x)
+
+
+def measure_startup(path):
+    """Loads path in a fresh interpreter and scores one beat, returns (seconds incl. imports, peak RSS in MB)."""
+
+    code = ("import resource, time, json; start = time.time(); import numpy as np; "
+            "from inference_export import InferenceModel; m = InferenceModel({!r}); "
+            "m.reconstruct(np.zeros((1, 140, 1), np.float32)); "
+            "print(json.dumps([time.time() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024]))"
+            ).format(path)
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    return tuple(json.loads(output.strip().splitlines()[-1]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', required=True, help='directory written by vae_model.save_vae')
+    parser.add_argument('--output', required=True, help='directory for the inference SavedModel')
+    parser.add_argument('--tflite', default=None, help='also convert to this .tflite file')
+    parser.add_argument('--tflite-batch-size', type=int, default=1, help='static batch size of the TFLite model')
+    args = parser.parse_args()
+
+    from vae_model import load_vae
+
+    encoder, decoder = load_vae(args.model)
+    export_saved_model(encoder, decoder, args.output)
+    paths = [args.output]
+    if args.tflite:
+        size = export_tflite(encoder, decoder, args.tflite, batch_size=args.tflite_batch_size)
+        print("TFLite model: {} ({:.1f} MB)".format(args.tflite, size / 2 ** 20))
+        paths.append(args.tflite)
+    for path in paths:
+        seconds, rss = measure_startup(path)
+        print("{}: startup and first beat {:.2f}s, peak RSS {:.0f} MB".format(path, seconds, rss))
+
+
+if __name__ == '__main__':
+    main()
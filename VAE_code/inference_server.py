@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""Low latency scoring of single heartbeats over HTTP (TCP or Unix socket) with request micro-batching.
+
+Requests are put into one queue. A batching thread takes the first waiting beat, gathers further beats until
+--max-batch-size is reached or --latency-budget-ms has passed since the first one arrived, and scores the whole batch
+with one call of the compiled forward pass of BeatScorer (score_beats.py). Thus under load the per call overhead is
+shared by many beats, while a single beat waits at most the latency budget.
+
+Endpoints:
+    POST /score  body {"beat": [140 floats]}  ->  {"mse": .., "kl": .., "z_mean": [..], "anomaly": ..}
+    GET  /stats  ->  requests, batches, mean batch size, queue depth and latency percentiles (ms)
+
+The load subcommand is a local load generator: several client threads send beats of a file as fast as possible (or at
+--rate requests/s per client) and report throughput and client side latency percentiles, followed by the server stats.
+
+Usage:
+    python inference_server.py serve --model vae_model --port 8500 --latency-budget-ms 5
+    python inference_server.py serve --model vae_model --unix-socket /tmp/vae.sock
+    python inference_server.py load --port 8500 --data ../ECG5000/ECG5000_TRAIN.txt --clients 16 --duration 10
+"""
+import argparse
+import collections
+import http.client
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+class PendingBeat:
+    """One queued request, the batching thread sets result (or error) and then the event."""
+
+    def __init__(self, beat):
+        self.beat = beat
+        self.arrival = time.perf_counter()
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """Gathers single beats into batches within a latency budget and scores them with scorer (a BeatScorer)."""
+
+    def __init__(self, scorer, max_batch_size=256, latency_budget_ms=5.0, stats_window=10000):
+        self.scorer = scorer
+        self.max_batch_size = max_batch_size
+        self.latency_budget = latency_budget_ms / 1000
+        self.queue = queue.Queue()
+        self.latencies = collections.deque(maxlen=stats_window)
+        self.n_requests = 0
+        self.n_batches = 0
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, beat, timeout=None):
+        """Scores one beat (array of shape (140,) or (140, 1)), blocks until its batch is done."""
+
+        pending = PendingBeat(np.asarray(beat, dtype=np.float32).reshape(-1, 1))
+        self.queue.put(pending)
+        if not pending.event.wait(timeout):
+            raise TimeoutError("Beat was not scored within {}s".format(timeout))
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _gather(self):
+        """Blocks for the first beat, then collects more until the batch is full or the budget is used up."""
+
+        batch = [self.queue.get()]
+        deadline = batch[0].arrival + self.latency_budget
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._gather()
+            try:
+                scores = self.scorer.score(np.stack([pending.beat for pending in batch]))
+                for i, pending in enumerate(batch):
+                    pending.result = {'mse': float(scores['mse'][i]), 'kl': float(scores['kl'][i]),
+                                      'z_mean': scores['z_mean'][i].tolist()}
+                    if 'anomaly' in scores:
+                        pending.result['anomaly'] = bool(scores['anomaly'][i])
+            except Exception as error:
+                for pending in batch:
+                    pending.error = error
+            done = time.perf_counter()
+            with self._lock:
+                self.n_requests += len(batch)
+                self.n_batches += 1
+                self.latencies.extend(done - pending.arrival for pending in batch)
+            for pending in batch:
+                pending.event.set()
+
+    def stats(self):
+        with self._lock:
+            latencies = np.array(self.latencies) * 1000
+            stats = {'requests': self.n_requests, 'batches': self.n_batches, 'queue_depth': self.queue.qsize(),
+                     'mean_batch_size': self.n_requests / self.n_batches if self.n_batches else 0.0}
+        for q in (50, 90, 99):
+            stats['latency_p{}_ms'.format(q)] = float(np.percentile(latencies, q)) if len(latencies) else None
+        return stats
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    """POST /score and GET /stats, the MicroBatcher is an attribute of the server."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send_json(200, self.server.batcher.stats())
+        else:
+            self._send_json(404, {'error': 'unknown path'})
+
+    def do_POST(self):
+        if self.path != '/score':
+            self._send_json(404, {'error': 'unknown path'})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            beat = np.asarray(request['beat'], dtype=np.float32)
+            if beat.size != self.server.series_length:
+                raise ValueError("beat has {} values, expected {}".format(beat.size, self.server.series_length))
+        except (ValueError, KeyError, TypeError) as error:
+            self._send_json(400, {'error': str(error)})
+            return
+        self._send_json(200, self.server.batcher.submit(beat))
+
+    def address_string(self):
+        # Unix sockets have no client address
+        return str(self.client_address[0]) if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        # no log line per request
+        pass
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+
+
+def make_server(batcher, series_length=140, port=8500, host='127.0.0.1', unix_socket=None):
+    """HTTP server on host:port or, if given, on the Unix socket path unix_socket."""
+
+    if unix_socket:
+        server = ThreadingUnixHTTPServer(unix_socket, ScoringHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), ScoringHandler)
+        server.daemon_threads = True
+    server.batcher = batcher
+    server.series_length = series_length
+    return server
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """http.client connection over a Unix socket."""
+
+    def __init__(self, path, timeout=60):
+        super(UnixHTTPConnection, self).__init__('localhost', timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+def _connect(args):
+    if args.unix_socket:
+        return UnixHTTPConnection(args.unix_socket)
+    return http.client.HTTPConnection(args.host, args.port, timeout=60)
+
+
+def _request(connection, method, path, payload=None):
+    body = json.dumps(payload) if payload is not None else None
+    connection.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def run_load(args):
+    """Load generator: --clients threads each send beats over one keep-alive connection for --duration seconds."""
+
+    from ecg5000_loader import load_ecg5000
+
+    series, _ = load_ecg5000(args.data)
+    beats = np.asarray(series, dtype=np.float32)
+    latencies = [[] for _ in range(args.clients)]
+    errors = [0] * args.clients
+    stop_time = time.perf_counter() + args.duration
+
+    def client(index):
+        rng = np.random.default_rng(index)
+        connection = _connect(args)
+        interval = 1 / args.rate if args.rate else 0
+        next_send = time.perf_counter()
+        while time.perf_counter() < stop_time:
+            if interval:
+                time.sleep(max(0.0, next_send - time.perf_counter()))
+                next_send += interval
+            beat = beats[rng.integers(len(beats))]
+            start = time.perf_counter()
+            status, _ = _request(connection, 'POST', '/score', {'beat': beat.tolist()})
+            latencies[index].append(time.perf_counter() - start)
+            if status != 200:
+                errors[index] += 1
+        connection.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    all_latencies = np.concatenate([np.array(client_latencies) for client_latencies in latencies]) * 1000
+    print("{} requests in {:.1f}s ({:.0f} beats/s), {} errors".format(len(all_latencies), elapsed,
+                                                                       len(all_latencies) / elapsed, sum(errors)))
+    if len(all_latencies):
+        print("client latency ms: p50 {:.2f}, p90 {:.2f}, p99 {:.2f}".format(
+            *np.percentile(all_latencies, [50, 90, 99])))
+    connection = _connect(args)
+    print("server stats: {}".format(_request(connection, 'GET', '/stats')[1]))
+    connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name, help_text in (('serve', 'run the scoring server'), ('load', 'run the load generator')):
+        subparser = subparsers.add_parser(name, help=help_text)
+        subparser.add_argument('--host', default='127.0.0.1')
+        subparser.add_argument('--port', type=int, default=8500)
+        subparser.add_argument('--unix-socket', default=None, help='serve on / connect to this Unix socket instead')
+    serve_parser = subparsers.choices['serve']
+    serve_parser.add_argument('--model', required=True, help='directory written by vae_model.save_vae')
+    serve_parser.add_argument('--threshold', type=float, default=None,
+                              help='anomaly threshold, default: the one stored by score_beats.py fit-threshold')
+    serve_parser.add_argument('--max-batch-size', type=int, default=256)
+    serve_parser.add_argument('--latency-budget-ms', type=float, default=5.0)
+    load_parser = subparsers.choices['load']
+    load_parser.add_argument('--data', default='../ECG5000/ECG5000_TRAIN.txt', help='file with beats to send')
+    load_parser.add_argument('--clients', type=int, default=16)
+    load_parser.add_argument('--duration', type=float, default=10.0, help='seconds')
+    load_parser.add_argument('--rate', type=float, default=None, help='requests/s per client, default: unlimited')
+    args = parser.parse_args(argv)
+
+    if args.command == 'load':
+        run_load(args)
+        return
+
+    from score_beats import BeatScorer, THRESHOLD_FILE, load_threshold
+    from vae_model import load_vae
+
+    encoder, decoder = load_vae(args.model)
+    threshold = args.threshold
+    if threshold is None and os.path.exists(os.path.join(args.model, THRESHOLD_FILE)):
+        threshold = load_threshold(args.model)
+    scorer = BeatScorer(encoder, decoder, threshold=threshold)
+    # trace the forward pass before the first request arrives
+    scorer.score(np.zeros((1,) + tuple(encoder.input_shape[1:]), dtype=np.float32))
+    batcher = MicroBatcher(scorer, max_batch_size=args.max_batch_size, latency_budget_ms=args.latency_budget_ms)
+    server = make_server(batcher, series_length=encoder.input_shape[1], port=args.port, host=args.host,
+                         unix_socket=args.unix_socket)
+    print("Serving on {}".format(args.unix_socket or '{}:{}'.format(args.host, args.port)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
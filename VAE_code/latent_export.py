@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""Compact binary export of latents, reconstructions and labels.
+
+Instead of formatting every float as text (np.savetxt), arrays are appended batch by batch to chunked .npy files in
+one export directory, floats as float32. A metadata.json next to the chunks records the dtype, shape and chunk files of
+every array plus free-form metadata such as the model and the data split. It is written last (atomically), thus a
+directory without it belongs to an unfinished export.
+
+Layout:
+    <directory>/metadata.json
+    <directory>/<name>-00000.npy, <name>-00001.npy, ...
+"""
+import glob
+import json
+import os
+
+import numpy as np
+
+METADATA_FILE = 'metadata.json'
+
+
+class ExportWriter:
+    """Appends named arrays batch by batch to chunked .npy files, at most chunk_rows rows are held in memory per name.
+
+    Usage:
+        with ExportWriter('export', metadata={'split': 'test'}) as writer:
+            for batch in batches:
+                writer.append(z_mean=..., decoded=..., labels=...)
+    """
+
+    def __init__(self, directory, metadata=None, chunk_rows=65536):
+        self.directory = directory
+        self.metadata = dict(metadata or {})
+        self.chunk_rows = chunk_rows
+        self._buffers = {}
+        self._arrays = {}
+        os.makedirs(directory, exist_ok=True)
+        # remove an old export, otherwise stale chunks of a larger one would be left behind
+        for path in glob.glob(os.path.join(directory, '*-[0-9][0-9][0-9][0-9][0-9].npy')) + \
+                glob.glob(os.path.join(directory, METADATA_FILE)):
+            os.remove(path)
+
+    def append(self, **arrays):
+        """Appends one batch of rows to each named array, floats are stored as float32."""
+
+        for name, values in arrays.items():
+            values = np.asarray(values)
+            if np.issubdtype(values.dtype, np.floating):
+                values = values.astype(np.float32, copy=False)
+            info = self._arrays.setdefault(name, {'dtype': values.dtype.str, 'shape': [0] + list(values.shape[1:]),
+                                                  'chunks': []})
+            if list(values.shape[1:]) != info['shape'][1:]:
+                raise ValueError("Rows of '{}' have shape {}, expected {}".format(name, values.shape[1:],
+                                                                               tuple(info['shape'][1:])))
+            buffer = self._buffers.setdefault(name, [])
+            buffer.append(values)
+            info['shape'][0] += len(values)
+            if sum(len(part) for part in buffer) >= self.chunk_rows:
+                self._flush(name)
+
+    def _flush(self, name):
+        buffer = self._buffers.get(name)
+        if not buffer:
+            return
+        info = self._arrays[name]
+        filename = '{}-{:05d}.npy'.format(name, len(info['chunks']))
+        np.save(os.path.join(self.directory, filename), np.concatenate(buffer).astype(info['dtype'], copy=False))
+        info['chunks'].append(filename)
+        self._buffers[name] = []
+
+    def close(self):
+        """Writes the remaining rows and the metadata file."""
+
+        for name in self._arrays:
+            self._flush(name)
+        path = os.path.join(self.directory, METADATA_FILE)
+        with open(path + '.tmp', 'w') as file:
+            json.dump({'metadata': self.metadata, 'arrays': self._arrays}, file, indent=2)
+        os.replace(path + '.tmp', path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # an export interrupted by an exception gets no metadata file, thus it cannot be mistaken for a complete one
+        if exc_type is None:
+            self.close()
+
+
+def read_metadata(directory):
+    with open(os.path.join(directory, METADATA_FILE), 'r') as file:
+        return json.load(file)
+
+
+def iter_chunks(directory, name, mmap_mode='r'):
+    """Yields the chunks of the array name of an export as (memory-mapped) arrays."""
+
+    for filename in read_metadata(directory)['arrays'][name]['chunks']:
+        yield np.load(os.path.join(directory, filename), mmap_mode=mmap_mode)
+
+
+def load_export(directory, names=None):
+    """Loads the arrays (all or names) of an export into memory, returns (dict name -> array, metadata)."""
+
+    metadata = read_metadata(directory)
+    arrays = {}
+    for name in names or metadata['arrays']:
+        info = metadata['arrays'][name]
+        chunks = list(iter_chunks(directory, name))
+        arrays[name] = np.concatenate(chunks) if chunks else np.empty(info['shape'], dtype=info['dtype'])
+    return arrays, metadata['metadata']
+
+
+def export_predictions(model, x, directory, labels=None, metadata=None, batch_size=4096, chunk_rows=65536,
+                       indices=None):
+    """Encodes and decodes x batch by batch with a VAE, appending z_mean, z_log_var, z_values, decoded (and labels).
+
+    indices selects the samples of x to export (e.g. a split of a memory-mapped ECG5000Dataset.x), they are gathered
+    batch by batch, labels are given per exported sample.
+    """
+
+    n = len(x) if indices is None else len(indices)
+    with ExportWriter(directory, metadata=metadata, chunk_rows=chunk_rows) as writer:
+        for start in range(0, n, batch_size):
+            if indices is None:
+                x_batch = np.asarray(x[start:start + batch_size])
+            else:
+                x_batch = np.asarray(x[indices[start:start + batch_size]])
+            z_mean, z_log_var, z_values = model.encode(x_batch, batch_size=batch_size)
+            decoded = model.decoder.predict(z_values, batch_size=batch_size, verbose=0)
+            batch = {'z_mean': z_mean, 'z_log_var': z_log_var, 'z_values': z_values,
+                     'decoded': decoded.reshape(len(x_batch), -1)}
+            if labels is not None:
+                batch['labels'] = labels[start:start + batch_size]
+            writer.append(**batch)
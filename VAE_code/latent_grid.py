@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Rendering of the decoded latent manifold of a VAE decoder.
+
+The whole n*n grid of latent vectors is decoded in one batched predict call instead of one call per grid point. Works
+with image decoders (e.g. the MNIST tutorials) and with the ECG time series decoder from create_decoder, where two
+chosen latent axes are swept while the other axes are kept at a base point.
+"""
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+
+
+def latent_grid(n=30, scale=2.0, latent_dim=2, axes=(0, 1), base=None):
+    """Returns (grid_x, grid_y, z), z of shape (n*n, latent_dim) sweeping axes around base, row by row."""
+
+    if base is None:
+        base = np.zeros(latent_dim)
+    # linearly spaced coordinates, grid_y from top to bottom as in an image
+    grid_x = np.linspace(-scale, scale, n) + base[axes[0]]
+    grid_y = np.linspace(-scale, scale, n)[::-1] + base[axes[1]]
+    z = np.tile(np.asarray(base, dtype=np.float32), (n * n, 1))
+    z[:, axes[0]] = np.tile(grid_x, n)
+    z[:, axes[1]] = np.repeat(grid_y, n)
+    return grid_x, grid_y, z
+
+
+def decode_latent_grid(decoder, n=30, scale=2.0, axes=(0, 1), base=None, batch_size=256):
+    """Decodes the latent grid in one predict call, returns (grid_x, grid_y, tiles) with tiles[i, j] at (x_j, y_i)."""
+
+    latent_dim = decoder.input_shape[-1]
+    grid_x, grid_y, z = latent_grid(n=n, scale=scale, latent_dim=latent_dim, axes=axes, base=base)
+    decoded = decoder.predict(z, batch_size=batch_size)
+    return grid_x, grid_y, decoded.reshape((n, n) + decoded.shape[1:])
+
+
+def tile_images(tiles):
+    """Assembles tiles of shape (n, n, h, w[, 1]) into one (n*h, n*w) image."""
+
+    n_rows, n_cols, height, width = tiles.shape[:4]
+    return tiles.reshape(n_rows, n_cols, height, width).transpose(0, 2, 1, 3).reshape(n_rows * height, n_cols * width)
+
+
+def plot_latent_manifold(decoder, n=30, scale=2.0, axes=(0, 1), base=None, figsize=15, batch_size=256):
+    """Displays the n*n manifold decoded from the latent grid, as image or as one curve per grid cell."""
+
+    grid_x, grid_y, tiles = decode_latent_grid(decoder, n=n, scale=scale, axes=axes, base=base,
+                                               batch_size=batch_size)
+    size = tiles.shape[2]
+    plt.figure(figsize=(figsize, figsize))
+    if tiles.ndim == 5 or (tiles.ndim == 4 and tiles.shape[-1] != 1):
+        # image decoder
+        plt.imshow(tile_images(tiles), cmap="Greys_r")
+    else:
+        # time series decoder, scale every curve into its grid cell and draw all of them as one collection
+        series = tiles.reshape(n, n, size)
+        low, high = series.min(), series.max()
+        scaled = (series - low) / max(high - low, 1e-12) * 0.8 * size + 0.1 * size
+        rows, cols = np.meshgrid(np.arange(n), np.arange(n), indexing='ij')
+        x = cols[..., np.newaxis] * size + np.arange(size)
+        # y axis is inverted like an image, thus subtract the curve from the lower cell border
+        y = (rows[..., np.newaxis] + 1) * size - scaled
+        segments = np.stack([x, y], axis=-1).reshape(n * n, size, 2)
+        plt.gca().add_collection(LineCollection(segments, linewidths=0.5))
+        plt.xlim(0, n * size)
+        plt.ylim(n * size, 0)
+    pixel_range = np.arange(n) * size + size // 2
+    plt.xticks(pixel_range, np.round(grid_x, 1))
+    plt.yticks(pixel_range, np.round(grid_y, 1))
+    plt.xlabel("z[{}]".format(axes[0]))
+    plt.ylabel("z[{}]".format(axes[1]))
+    plt.show()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""Opt-in per-layer profiling of the encoder and decoder of a VAE.
+
+profile_layers runs a few training steps eagerly (gradients are computed, but not applied) with the call of every
+encoder/decoder layer wrapped, recording per layer
+    - forward time: wall time of the layer call
+    - backward time: wall time from the gradient reaching the outputs of the layer until it reached its inputs
+    - activation memory: bytes of the layer outputs
+The wrappers only exist during profile_layers, the model, train_step and fit are not changed, thus there is no
+overhead when profiling is not used. Times are measured in eager mode, they include the per op dispatch overhead and
+are meant to compare the layers with each other (e.g. Encode_1 vs Decode_1), not as absolute step times of fit.
+
+The results are exported as a table (pandas DataFrame / CSV) and as a trace file in the Chrome trace event format,
+which can be opened offline in chrome://tracing or Perfetto.
+"""
+import json
+import time
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+from tensorflow import keras
+
+
+def _gradient_marker(record):
+    """Identity op which calls record(time) when its gradient is computed."""
+
+    @tf.custom_gradient
+    def identity(x):
+        def grad(dy):
+            record(time.perf_counter())
+            return dy
+
+        return tf.identity(x), grad
+
+    return identity
+
+
+def _mark(structure, record):
+    """Applies a gradient marker to all float tensors in structure."""
+
+    marker = _gradient_marker(record)
+    return tf.nest.map_structure(
+        lambda t: marker(t) if tf.is_tensor(t) and t.dtype.is_floating else t, structure)
+
+
+class LayerProfile:
+    """Per layer records of profile_layers, one dict per (step, layer)."""
+
+    def __init__(self, records):
+        self.records = records
+
+    def table(self):
+        """Mean forward/backward time (ms) and activation memory (KB) per layer, in forward order."""
+
+        frame = pd.DataFrame(self.records)
+        table = frame.groupby(['model', 'layer'], sort=False).agg(
+            forward_ms=('forward_ms', 'mean'), backward_ms=('backward_ms', 'mean'),
+            activation_kb=('activation_bytes', lambda b: b.mean() / 1024)).reset_index()
+        total = table['forward_ms'] + table['backward_ms'].fillna(0)
+        table['share'] = total / total.sum()
+        return table
+
+    def to_csv(self, path):
+        self.table().to_csv(path, index=False)
+
+    def to_trace(self, path):
+        """Writes the forward and backward spans of all layers as Chrome trace events (JSON)."""
+
+        events = []
+        for record in self.records:
+            name = '{}/{}'.format(record['model'], record['layer'])
+            args = {'step': record['step'], 'activation_bytes': record['activation_bytes']}
+            events.append({'name': name, 'cat': 'forward', 'ph': 'X', 'pid': 0, 'tid': 'forward',
+                           'ts': record['forward_start'] * 1e6, 'dur': record['forward_ms'] * 1e3, 'args': args})
+            if not np.isnan(record['backward_ms']):
+                events.append({'name': name, 'cat': 'backward', 'ph': 'X', 'pid': 0, 'tid': 'backward',
+                               'ts': record['backward_start'] * 1e6, 'dur': record['backward_ms'] * 1e3,
+                               'args': args})
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+    def __str__(self):
+        return self.table().to_string(index=False, float_format='{:.3f}'.format)
+
+
+def _instrument(layer, model_name, step_records):
+    """Replaces the call of layer by a timed, gradient marked one, returns a function which undoes it."""
+
+    original_call = layer.call
+
+    def call(inputs, *args, **kwargs):
+        record = {'model': model_name, 'layer': layer.name, 'backward_start': np.inf, 'backward_end': -np.inf}
+
+        def backward_started(t):
+            record['backward_start'] = min(record['backward_start'], t)
+
+        def backward_ended(t):
+            record['backward_end'] = max(record['backward_end'], t)
+
+        inputs = _mark(inputs, backward_ended)
+        start = time.perf_counter()
+        outputs = original_call(inputs, *args, **kwargs)
+        # eager ops on CPU are synchronous, reading one value makes sure the outputs are computed
+        for output in tf.nest.flatten(outputs):
+            np.asarray(output).flat[:1]
+        record['forward_start'], record['forward_ms'] = start, 1000 * (time.perf_counter() - start)
+        record['activation_bytes'] = int(sum(np.prod(o.shape) * o.dtype.size for o in tf.nest.flatten(outputs)))
+        step_records.append(record)
+        return _mark(outputs, backward_started)
+
+    # instance attribute, shadows the call method of the class until it is deleted again
+    object.__setattr__(layer, 'call', call)
+    return lambda: object.__delattr__(layer, 'call')
+
+
+def profile_layers(model, x, batch_size=16, n_steps=5, warmup=1, seed=None):
+    """Profiles n_steps training steps (after warmup steps) of the VAE model on random batches of x.
+
+    The losses and gradients are computed as in VAE.train_step, the weights are not updated. Returns a LayerProfile.
+    """
+
+    rng = np.random.default_rng(seed)
+    step_records = []
+    restore = [_instrument(layer, sub_model.name, step_records)
+               for sub_model in (model.encoder, model.decoder) for layer in sub_model.layers
+               if not isinstance(layer, keras.layers.InputLayer)]
+    records = []
+    try:
+        for step in range(warmup + n_steps):
+            step_records.clear()
+            batch = tf.convert_to_tensor(np.asarray(x[np.sort(rng.choice(len(x), batch_size, replace=False))],
+                                                    dtype=np.float32))
+            with tf.GradientTape() as tape:
+                z_mean, z_log_var, z = model.encoder(batch, training=True)
+                reconstruction = model.decoder(z, training=True)
+                total_loss, _, _ = model.compute_losses(batch, reconstruction, z_mean, z_log_var)
+            tape.gradient(total_loss, model.trainable_weights)
+            end = time.perf_counter()
+            if step < warmup:
+                continue
+            for record in step_records:
+                # the gradient of the first layer's input is not needed, its backward pass ends with tape.gradient
+                if np.isinf(record['backward_start']):
+                    record['backward_start'], record['backward_ms'] = np.nan, np.nan
+                else:
+                    backward_end = record['backward_end'] if np.isfinite(record['backward_end']) else end
+                    record['backward_ms'] = 1000 * (backward_end - record['backward_start'])
+                del record['backward_end']
+                record['step'] = step - warmup
+                records.append(record)
+    finally:
+        for undo in restore:
+            undo()
+    return LayerProfile(records)
+
+
+class LayerProfilerCallback(keras.callbacks.Callback):
+    """Profiles the layers at the end of the given epochs (1-based) and writes <prefix>_epoch<n>.csv/.trace.json."""
+
+    def __init__(self, x_sample, prefix='layer_profile', epochs=(1,), batch_size=16, n_steps=5):
+        super(LayerProfilerCallback, self).__init__()
+        self.x_sample = x_sample
+        self.prefix = prefix
+        self.epochs = set(epochs)
+        self.batch_size = batch_size
+        self.n_steps = n_steps
+
+    def on_epoch_end(self, epoch, logs=None):
+        if epoch + 1 not in self.epochs:
+            return
+        profile = profile_layers(self.model, self.x_sample, batch_size=self.batch_size, n_steps=self.n_steps)
+        profile.to_csv('{}_epoch{}.csv'.format(self.prefix, epoch + 1))
+        profile.to_trace('{}_epoch{}.trace.json'.format(self.prefix, epoch + 1))
+        print("\nLayer profile after epoch {}:\n{}".format(epoch + 1, profile))
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""Randomized hyperparameter search which trains the candidates in a process pool.
+
+Every (candidate, fold) pair is one task. The workers limit the TensorFlow thread pools, so that n_jobs workers share
+the cores instead of oversubscribing them, and read the training data from one memory-mapped .npy file. Results are
+collected in the same format as RandomizedSearchCV.cv_results_ and, if a SearchResultStore is given, appended to it as
+soon as each task finishes, so a restarted search only runs the missing tasks.
+"""
+import inspect
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import tensorflow as tf
+from sklearn.base import BaseEstimator, RegressorMixin
+from sklearn.model_selection import KFold, ParameterSampler
+
+from search_store import SearchResultStore, cv_results
+
+
+class KerasPredictor(RegressorMixin, BaseEstimator):
+    """Minimal estimator interface around a fitted keras model, predicts like KerasRegressor (squeezed output)."""
+
+    def __init__(self, model, batch_size=32):
+        self.model = model
+        self.batch_size = batch_size
+
+    def predict(self, x):
+        return np.squeeze(self.model.predict(x, batch_size=self.batch_size, verbose=0))
+
+
+def split_params(build_fn, params):
+    """Splits params into the arguments of build_fn and the remaining arguments for fit."""
+
+    build_args = inspect.signature(build_fn).parameters
+    build_params = {key: value for key, value in params.items() if key in build_args}
+    fit_params = {key: value for key, value in params.items() if key not in build_args}
+    return build_params, fit_params
+
+
+def fit_candidate(build_fn, params, x, fit_defaults=None):
+    """Builds a model with the build_fn arguments of params and fits it on x, returns a KerasPredictor."""
+
+    build_params, fit_params = split_params(build_fn, params)
+    fit_params = dict(fit_defaults or {}, **fit_params)
+    model = build_fn(**build_params)
+    model.fit(x, x, **fit_params)
+    return KerasPredictor(model, batch_size=fit_params.get('batch_size', 32))
+
+
+def _init_worker(intra_op_threads, inter_op_threads):
+    """Limits the thread pools of TensorFlow (and OpenMP/MKL) in a worker process."""
+
+    os.environ['OMP_NUM_THREADS'] = str(intra_op_threads)
+    os.environ['MKL_NUM_THREADS'] = str(intra_op_threads)
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
+
+def _fit_and_score(build_fn, params, x_path, train, test, scoring, fit_defaults, seed):
+    """Worker task: trains one candidate on one fold and returns (test score, fit time, score time)."""
+
+    tf.random.set_seed(seed)
+    x = np.load(x_path, mmap_mode='r')
+    start = time.time()
+    predictor = fit_candidate(build_fn, params, x[train], fit_defaults=fit_defaults)
+    fit_time = time.time() - start
+    start = time.time()
+    score = scoring(predictor, x[test], x[test])
+    score_time = time.time() - start
+    return score, fit_time, score_time
+
+
+class ParallelRandomizedSearch:
+    """Randomized search over build_fn/fit parameters, training (candidate, fold) tasks in a process pool.
+
+    Candidates and folds are drawn like RandomizedSearchCV (ParameterSampler, KFold), thus the same random_state gives
+    the same candidates. Parameters which are arguments of build_fn are passed to it, all others (e.g. batch_size,
+    epochs) to fit. scoring is a sklearn scorer scorer(estimator, x, y), it has to be picklable (module level).
+    store is a SearchResultStore (or its path) receiving every finished task, tasks already in it are skipped.
+    """
+
+    def __init__(self, build_fn, param_distributions, scoring, n_iter=10, cv=5, n_jobs=None, threads_per_worker=None,
+                 inter_op_threads=1, fit_defaults=None, refit=True, random_state=1, store=None, verbose=0):
+        self.build_fn = build_fn
+        self.param_distributions = param_distributions
+        self.scoring = scoring
+        self.n_iter = n_iter
+        self.cv = cv
+        self.n_jobs = n_jobs or os.cpu_count()
+        self.threads_per_worker = threads_per_worker or max(1, os.cpu_count() // self.n_jobs)
+        self.inter_op_threads = inter_op_threads
+        self.fit_defaults = dict(fit_defaults or {'verbose': 0})
+        self.refit = refit
+        self.random_state = random_state
+        self.store = SearchResultStore(store) if isinstance(store, str) else store
+        self.verbose = verbose
+
+    def fit(self, x):
+        """Runs the search on x (input is also the target) and sets cv_results_ and best_*."""
+
+        candidates = list(ParameterSampler(self.param_distributions, self.n_iter, random_state=self.random_state))
+        folds = list(KFold(n_splits=self.cv).split(x))
+        scores = np.zeros((len(candidates), len(folds)))
+        fit_times = np.zeros_like(scores)
+        score_times = np.zeros_like(scores)
+
+        # take the results of tasks finished in an earlier run from the store
+        tasks = []
+        completed = self.store.completed() if self.store is not None else {}
+        for i, params in enumerate(candidates):
+            for k in range(len(folds)):
+                record = completed.get(SearchResultStore.task_key(params, k, len(folds), len(x)))
+                if record is None:
+                    tasks.append((i, k))
+                else:
+                    scores[i, k], fit_times[i, k], score_times[i, k] = (record['score'], record['fit_time'],
+                                                                        record['score_time'])
+        if self.verbose and len(tasks) < scores.size:
+            print("Skipping {} of {} tasks already in the result store".format(scores.size - len(tasks), scores.size))
+
+        # share the data with the workers through one memory-mapped file instead of pickling it per task
+        tmp_dir = tempfile.mkdtemp(prefix='parallel_search_')
+        x_path = os.path.join(tmp_dir, 'x.npy')
+        np.save(x_path, np.asarray(x, dtype=np.float32))
+        context = multiprocessing.get_context('spawn')
+        try:
+            with ProcessPoolExecutor(max_workers=self.n_jobs, mp_context=context, initializer=_init_worker,
+                                     initargs=(self.threads_per_worker, self.inter_op_threads)) as executor:
+                futures = {}
+                for i, k in tasks:
+                    train, test = folds[k]
+                    future = executor.submit(_fit_and_score, self.build_fn, candidates[i], x_path, train, test,
+                                             self.scoring, self.fit_defaults, self.random_state)
+                    futures[future] = (i, k)
+                for future in as_completed(futures):
+                    i, k = futures[future]
+                    scores[i, k], fit_times[i, k], score_times[i, k] = future.result()
+                    if self.store is not None:
+                        self.store.append(candidates[i], k, len(folds), len(x), scores[i, k], fit_times[i, k],
+                                          score_times[i, k])
+                    if self.verbose:
+                        print("[CV {}/{}] candidate {}: {}, score={:.4f}, fit time={:.1f}s".format(
+                            k + 1, len(folds), i, candidates[i], scores[i, k], fit_times[i, k]))
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        self.cv_results_ = cv_results(candidates, scores, fit_times, score_times)
+        # diverged candidates (nan score) can never be the best one
+        self.best_index_ = int(np.argmax(np.nan_to_num(self.cv_results_['mean_test_score'], nan=-np.inf)))
+        self.best_score_ = self.cv_results_['mean_test_score'][self.best_index_]
+        self.best_params_ = candidates[self.best_index_]
+        if self.refit:
+            self.best_estimator_ = fit_candidate(self.build_fn, self.best_params_, x, fit_defaults=self.fit_defaults)
+        return self
+
+    def predict(self, x):
+        return self.best_estimator_.predict(x)
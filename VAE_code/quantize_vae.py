@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Post-training quantization of a trained encoder/decoder for cheaper CPU inference.
+
+The encode/decode/reconstruct signatures (see inference_export.py) are converted to TFLite three times:
+    float32  -- no quantization, the reference
+    dynamic  -- dynamic range quantization, int8 weights, activations quantized on the fly
+    int8     -- full integer quantization, activation ranges calibrated on a sample of x_train (float kernels remain
+                for ops without an int8 kernel)
+For each model the file size, the latency of reconstruct per batch (p50/p99) and the reconstruction MSE on the test
+split are reported, together with the drift against float32 (change of the MSE and the mean squared difference of the
+reconstructions). The results are written to a JSON file next to the .tflite files.
+
+Usage:
+    python quantize_vae.py --model vae_model --data ../ECG5000/ECG5000_TRAIN.txt --output-dir quantized
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import tensorflow as tf
+
+from ecg5000_dataset import ECG5000Dataset
+from inference_export import InferenceModel, export_tflite
+from scoring import score_mse
+from vae_model import load_vae
+
+# unquantized variant, the drifts and ratios of the others are relative to it
+REFERENCE = 'float32'
+
+
+def representative_dataset(encoder, x_calibration, batch_size):
+    """Calibration batches for all signatures, the decoder is calibrated on the z_mean of x_calibration."""
+
+    z_calibration = encoder.predict(x_calibration, batch_size=256, verbose=0)[0]
+
+    def generator():
+        for start in range(0, len(x_calibration) - batch_size + 1, batch_size):
+            x = np.asarray(x_calibration[start:start + batch_size], dtype=np.float32)
+            z = np.asarray(z_calibration[start:start + batch_size], dtype=np.float32)
+            yield 'encode', {'x': x}
+            yield 'reconstruct', {'x': x}
+            yield 'decode', {'z': z}
+
+    return generator
+
+
+def convert_variant(name, model_dir, path, batch_size, x_calibration):
+    """Converts the model in model_dir to the TFLite variant name, returns the file size (runs in a worker process)."""
+
+    encoder, decoder = load_vae(model_dir)
+    options = {}
+    if name in ('dynamic', 'int8'):
+        options['optimizations'] = [tf.lite.Optimize.DEFAULT]
+    if name == 'int8':
+        options['int8'] = True
+        options['representative_dataset'] = representative_dataset(encoder, x_calibration, batch_size)
+    return export_tflite(encoder, decoder, path, batch_size=batch_size, **options)
+
+
+def latency_ms(model, x, repeats):
+    """p50/p99 latency of model.reconstruct for one batch of x, after a warm up call."""
+
+    model.reconstruct(x)
+    times = np.empty(repeats)
+    for i in range(repeats):
+        start = time.perf_counter()
+        model.reconstruct(x)
+        times[i] = time.perf_counter() - start
+    return 1000 * float(np.percentile(times, 50)), 1000 * float(np.percentile(times, 99))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', required=True, help='directory written by vae_model.save_vae')
+    parser.add_argument('--data', default='../ECG5000/ECG5000_TRAIN.txt', help='ECG5000 file, split as in training')
+    parser.add_argument('--output-dir', default='quantized')
+    parser.add_argument('--calibration-samples', type=int, default=500, help='samples of x_train for calibration')
+    parser.add_argument('--batch-size', type=int, default=16, help='static batch size of the TFLite models')
+    parser.add_argument('--repeats', type=int, default=100, help='timed reconstruct calls per model')
+    args = parser.parse_args()
+
+    dataset = ECG5000Dataset(args.data)
+    train_idx, test_idx = dataset.split(test_size=0.2, shuffle=True, random_state=1)
+    rng = np.random.default_rng(1)
+    calibration_idx = np.sort(rng.choice(train_idx, min(args.calibration_samples, len(train_idx)), replace=False))
+    x_calibration = dataset.take(calibration_idx)
+    x_test = dataset.take(test_idx)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    results = {}
+    reference = None
+    for name in (REFERENCE, 'dynamic', 'int8'):
+        path = os.path.join(args.output_dir, 'vae_{}.tflite'.format(name))
+        # convert in a fresh process, a crash of the TFLite calibrator (seen for the LSTM kernels with some TF
+        # versions) then only fails this variant
+        try:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                size = executor.submit(convert_variant, name, args.model, path, args.batch_size,
+                                       x_calibration).result()
+        except BrokenProcessPool:
+            if name == REFERENCE:
+                sys.exit("Conversion to {} crashed, it is the reference of all drifts and ratios".format(REFERENCE))
+            print("Conversion to {} crashed, skipping it".format(name))
+            continue
+        model = InferenceModel(path)
+        reconstruction = model.reconstruct(x_test)['reconstruction']
+        p50, p99 = latency_ms(model, x_test[:args.batch_size], args.repeats)
+        if name == REFERENCE:
+            reference = reconstruction
+        results[name] = {
+            'path': path,
+            'size_bytes': size,
+            'latency_p50_ms': p50,
+            'latency_p99_ms': p99,
+            'test_mse': score_mse(x_test, reconstruction),
+            'reconstruction_drift_mse': score_mse(reference, reconstruction),
+        }
+    for result in results.values():
+        result['mse_drift'] = result['test_mse'] - results[REFERENCE]['test_mse']
+        result['size_ratio'] = result['size_bytes'] / results[REFERENCE]['size_bytes']
+        result['speedup_p50'] = results[REFERENCE]['latency_p50_ms'] / result['latency_p50_ms']
+
+    header = "{:<8} {:>10} {:>7} {:>9} {:>9} {:>8} {:>10} {:>11} {:>11}".format(
+        'model', 'size KB', 'ratio', 'p50 ms', 'p99 ms', 'speedup', 'test MSE', 'MSE drift', 'recon drift')
+    print(header)
+    print('-' * len(header))
+    for name, result in results.items():
+        print("{:<8} {:>10.1f} {:>7.2f} {:>9.2f} {:>9.2f} {:>8.2f} {:>10.5f} {:>+11.5f} {:>11.2e}".format(
+            name, result['size_bytes'] / 1024, result['size_ratio'], result['latency_p50_ms'],
+            result['latency_p99_ms'], result['speedup_p50'], result['test_mse'], result['mse_drift'],
+            result['reconstruction_drift_mse']))
+    with open(os.path.join(args.output_dir, 'quantization.json'), 'w') as file:
+        json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""Batch scoring of heartbeats for reconstruction error anomaly detection.
+
+Loads an encoder/decoder saved by vae_model.save_vae and streams heartbeat files through them in large batches. For
+every beat the reconstruction MSE (decoded from z_mean, no sampling), the KL divergence, z_mean and an anomaly flag
+(MSE above the threshold learned on training data, only if a threshold is known) are written to a CSV file. Input files
+are read memory-mapped chunk by chunk, thus memory stays bounded by --batch-size independent of the number of beats.
+
+Usage:
+    python score_beats.py fit-threshold --model vae_model --data ../ECG5000/ECG5000_TRAIN.txt --quantile 0.99
+    python score_beats.py score --model vae_model --input beats.txt shards/test/*.f32 --output scores.csv
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from ecg5000_loader import load_ecg5000
+from vae_model import load_vae
+
+THRESHOLD_FILE = 'threshold.json'
+
+
+def open_beats(path, series_length=140):
+    """Memory-maps a heartbeat file as (beats, time steps, 1), raw .f32 shards or any ECG5000 text format."""
+
+    if path.endswith('.f32'):
+        return np.memmap(path, dtype='<f4', mode='r').reshape(-1, series_length, 1)
+    series, _ = load_ecg5000(path, mmap_mode='r')
+    return series[:, :, np.newaxis]
+
+
+class BeatScorer:
+    """Computes per beat reconstruction MSE, KL divergence and z_mean in one compiled forward pass per batch."""
+
+    def __init__(self, encoder, decoder, threshold=None):
+        self.encoder = encoder
+        self.decoder = decoder
+        self.threshold = threshold
+        series_length = encoder.input_shape[1]
+        # fixed input signature, thus the last (smaller) batch of a file does not trigger a retrace
+        self._score_batch = tf.function(self._forward, input_signature=[
+            tf.TensorSpec(shape=(None, series_length, 1), dtype=tf.float32)])
+
+    def _forward(self, x):
+        z_mean, z_log_var, _ = self.encoder(x, training=False)
+        reconstruction = tf.cast(self.decoder(z_mean, training=False), tf.float32)
+        mse = tf.reduce_mean(tf.math.squared_difference(x, reconstruction), axis=[1, 2])
+        kl = -0.5 * tf.reduce_mean(1 + z_log_var - tf.square(z_mean) - tf.exp(z_log_var), axis=1)
+        return mse, kl, z_mean
+
+    def score(self, x):
+        """Scores one batch of beats, returns a dict of numpy arrays (mse, kl, z_mean and anomaly)."""
+
+        mse, kl, z_mean = self._score_batch(tf.convert_to_tensor(np.asarray(x, dtype=np.float32)))
+        scores = {'mse': mse.numpy(), 'kl': kl.numpy(), 'z_mean': z_mean.numpy()}
+        if self.threshold is not None:
+            scores['anomaly'] = scores['mse'] > self.threshold
+        return scores
+
+    def iter_scores(self, x, batch_size=4096):
+        """Yields (start index, scores) for consecutive batches of x."""
+
+        for start in range(0, len(x), batch_size):
+            yield start, self.score(x[start:start + batch_size])
+
+
+def fit_threshold(scorer, x, quantile=0.99, batch_size=4096):
+    """Returns the quantile of the reconstruction MSE of the (normal) training beats x."""
+
+    mse = np.concatenate([scores['mse'] for _, scores in scorer.iter_scores(x, batch_size=batch_size)])
+    return float(np.quantile(mse, quantile))
+
+
+def save_threshold(model_dir, threshold, quantile, n_beats, source):
+    with open(os.path.join(model_dir, THRESHOLD_FILE), 'w') as file:
+        json.dump({'threshold': threshold, 'quantile': quantile, 'n_beats': n_beats, 'source': source}, file,
+                  indent=2)
+
+
+def load_threshold(model_dir):
+    with open(os.path.join(model_dir, THRESHOLD_FILE), 'r') as file:
+        return json.load(file)['threshold']
+
+
+def score_files(scorer, paths, output, batch_size=4096):
+    """Scores all beats of paths into the CSV file output, returns (number of beats, seconds).
+
+    The anomaly column is only written if the scorer has a threshold.
+    """
+
+    latent_dim = scorer.encoder.output_shape[0][-1]
+    with_anomaly = scorer.threshold is not None
+    columns = ['file', 'beat', 'mse', 'kl'] + ['z_mean_{}'.format(i) for i in range(latent_dim)]
+    fmt = ['%d', '%d'] + ['%.6g'] * (2 + latent_dim)
+    if with_anomaly:
+        columns.append('anomaly')
+        fmt.append('%d')
+    n_beats, start_time = 0, time.time()
+    with open(output, 'w') as file:
+        file.write(','.join(columns) + '\n')
+        for file_index, path in enumerate(paths):
+            x = open_beats(path, series_length=scorer.encoder.input_shape[1])
+            for start, scores in scorer.iter_scores(x, batch_size=batch_size):
+                n = len(scores['mse'])
+                values = [np.full(n, file_index), np.arange(start, start + n), scores['mse'], scores['kl'],
+                          scores['z_mean']]
+                if with_anomaly:
+                    values.append(scores['anomaly'])
+                np.savetxt(file, np.column_stack(values), delimiter=',', fmt=fmt)
+                n_beats += n
+    return n_beats, time.time() - start_time
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    fit_parser = subparsers.add_parser('fit-threshold', help='learn the anomaly threshold from training beats')
+    fit_parser.add_argument('--model', required=True, help='directory written by vae_model.save_vae')
+    fit_parser.add_argument('--data', required=True, help='file with (normal) training beats')
+    fit_parser.add_argument('--quantile', type=float, default=0.99)
+    fit_parser.add_argument('--batch-size', type=int, default=4096)
+
+    score_parser = subparsers.add_parser('score', help='score heartbeat files')
+    score_parser.add_argument('--model', required=True, help='directory written by vae_model.save_vae')
+    score_parser.add_argument('--input', required=True, nargs='+', help='heartbeat files (.f32 or ECG5000 text)')
+    score_parser.add_argument('--output', required=True, help='CSV file for the per beat scores')
+    score_parser.add_argument('--threshold', type=float, default=None,
+                              help='anomaly threshold, default: the one stored by fit-threshold')
+    score_parser.add_argument('--batch-size', type=int, default=4096)
+
+    args = parser.parse_args(argv)
+    encoder, decoder = load_vae(args.model)
+
+    if args.command == 'fit-threshold':
+        scorer = BeatScorer(encoder, decoder)
+        x = open_beats(args.data, series_length=encoder.input_shape[1])
+        threshold = fit_threshold(scorer, x, quantile=args.quantile, batch_size=args.batch_size)
+        save_threshold(args.model, threshold, args.quantile, len(x), args.data)
+        print("Threshold ({} quantile of the MSE of {} beats): {}".format(args.quantile, len(x), threshold))
+    else:
+        threshold = args.threshold
+        if threshold is None and os.path.exists(os.path.join(args.model, THRESHOLD_FILE)):
+            threshold = load_threshold(args.model)
+        scorer = BeatScorer(encoder, decoder, threshold=threshold)
+        n_beats, seconds = score_files(scorer, args.input, args.output, batch_size=args.batch_size)
+        print("Scored {} beats in {:.1f}s ({:.0f} beats/s)".format(n_beats, seconds, n_beats / max(seconds, 1e-9)),
+              file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
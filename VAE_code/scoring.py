@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Scorers for the hyperparameter search of the ECG5000 VAE: MSE, per sample reconstruction error and KL divergence.
+
+Kept in a module so that the scorers can be pickled into the workers of the parallel search. All scorers are pure
+numpy and work through the samples in chunks of chunk_rows with one reusable buffer, thus they accept arbitrarily large
+(also memory-mapped) arrays without converting them to tensors or allocating full size intermediates.
+"""
+import numpy as np
+
+CHUNK_ROWS = 4096
+
+
+def _as_samples(y, n_samples=None):
+    """View of y as (n_samples (default len(y)), values per sample), no copy for contiguous arrays."""
+
+    y = np.asarray(y)
+    return y.reshape(len(y) if n_samples is None else n_samples, -1)
+
+
+def _chunk_differences(y_true, y_pred, chunk_rows):
+    """Yields (start, y_pred - y_true) per chunk of samples, written into one float64 buffer."""
+
+    if np.size(y_true) != np.size(y_pred):
+        raise ValueError("y_true and y_pred differ in size: {} and {}".format(np.shape(y_true), np.shape(y_pred)))
+    # both are split into the samples of y_true, thus y_pred may have lost its sample axis (e.g. squeezed)
+    y_true = _as_samples(y_true)
+    y_pred = _as_samples(y_pred, len(y_true))
+    buffer = np.empty((min(chunk_rows, len(y_true)), y_true.shape[1]))
+    for start in range(0, len(y_true), chunk_rows):
+        stop = min(start + chunk_rows, len(y_true))
+        diff = buffer[:stop - start]
+        np.subtract(y_pred[start:stop], y_true[start:stop], out=diff)
+        yield start, diff
+
+
+### Define scorer
+def score_mse(y_true, y_pred, chunk_rows=CHUNK_ROWS):
+    """Implementing mean squared error as a score for RandomizedSearchCV."""
+
+    # size 1 dimensions (e.g. the feature axis of y_true) are ignored, only the number of values has to match
+    total, size = 0.0, 0
+    for _, diff in _chunk_differences(y_true, y_pred, chunk_rows):
+        # sum of squares without a squared copy of the chunk
+        total += np.einsum('ij,ij->', diff, diff)
+        size += diff.size
+    return total / size if size else np.nan
+
+
+def per_sample_error(y_true, y_pred, chunk_rows=CHUNK_ROWS, out=None):
+    """Reconstruction MSE of every sample, written into out (float64 array of length samples) if given."""
+
+    if out is None:
+        out = np.empty(len(y_true))
+    for start, diff in _chunk_differences(y_true, y_pred, chunk_rows):
+        np.einsum('ij,ij->i', diff, diff, out=out[start:start + len(diff)])
+        out[start:start + len(diff)] /= diff.shape[1]
+    return out
+
+
+def kl_divergence(z_mean, z_log_var, chunk_rows=CHUNK_ROWS, per_sample=False):
+    """KL divergence of N(z_mean, exp(z_log_var)) from N(0, 1), averaged over the latent dimensions as in the VAE loss.
+
+    Returns the mean over all samples, or an array with the value of every sample if per_sample.
+    """
+
+    z_mean = _as_samples(z_mean)
+    z_log_var = _as_samples(z_log_var, len(z_mean))
+    out = np.empty(len(z_mean)) if per_sample else None
+    # two reusable buffers, one for the sum of the terms and one for the term being added
+    buffer = np.empty((min(chunk_rows, len(z_mean)), z_mean.shape[1]))
+    squares = np.empty_like(buffer)
+    total = 0.0
+    for start in range(0, len(z_mean), chunk_rows):
+        stop = min(start + chunk_rows, len(z_mean))
+        term, square = buffer[:stop - start], squares[:stop - start]
+        # 1 + z_log_var - z_mean^2 - exp(z_log_var), computed in place
+        np.exp(z_log_var[start:stop], out=term)
+        np.subtract(z_log_var[start:stop], term, out=term)
+        term += 1
+        term -= np.square(z_mean[start:stop], out=square)
+        if per_sample:
+            np.mean(term, axis=1, out=out[start:stop])
+        else:
+            total += term.sum()
+    if per_sample:
+        out *= -0.5
+        return out
+    return -0.5 * total / z_mean.size if z_mean.size else np.nan
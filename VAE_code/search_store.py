@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""Append-only JSONL store for the results of hyperparameter searches.
+
+Every finished (params, fold) task is written as one line as soon as it completes, so a crashed search loses at most
+the tasks which were running. On restart the search skips all (params, fold) combinations already in the store.
+"""
+import json
+import os
+
+import numpy as np
+
+
+def _to_builtin(value):
+    """json default for numpy scalars and arrays."""
+
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError("Object of type {} is not JSON serializable".format(type(value).__name__))
+
+
+def params_key(params):
+    """Canonical string of a parameter dict, independent of key order and numpy types."""
+
+    return json.dumps(params, sort_keys=True, default=_to_builtin)
+
+
+class SearchResultStore:
+    """Results of (params, fold) tasks in an append-only JSONL file.
+
+    A record holds params, fold, n_folds, n_samples, score, fit_time and score_time. n_folds and n_samples are part of
+    the task key, since the folds differ if either changes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def records(self):
+        """Returns all stored records, a torn last line of a crashed run is ignored."""
+
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path, 'r') as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+        return records
+
+    @staticmethod
+    def task_key(params, fold, n_folds, n_samples):
+        return params_key(params), fold, n_folds, n_samples
+
+    def completed(self):
+        """Returns a dict task key -> record of all finished tasks."""
+
+        return {self.task_key(record['params'], record['fold'], record['n_folds'], record['n_samples']): record
+                for record in self.records()}
+
+    def append(self, params, fold, n_folds, n_samples, score, fit_time, score_time):
+        """Appends the result of one task and flushes it to disk."""
+
+        record = {'params': params, 'fold': fold, 'n_folds': n_folds, 'n_samples': n_samples, 'score': score,
+                  'fit_time': fit_time, 'score_time': score_time}
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        line = json.dumps(record, default=_to_builtin) + '\n'
+        # start on a new line if a crashed run left a torn last line behind
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path, 'rb') as file:
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b'\n':
+                    line = '\n' + line
+        with open(self.path, 'a') as file:
+            file.write(line)
+            file.flush()
+            os.fsync(file.fileno())
+
+    def cv_results(self, n_folds=None, n_samples=None):
+        """Aggregates the stored records per parameter set in the format of RandomizedSearchCV.cv_results_.
+
+        Only parameter sets with all folds finished are included, only of one n_folds (default: the one of the last
+        record) and optionally of one n_samples setting.
+        """
+
+        records = self.records()
+        if n_folds is None:
+            n_folds = records[-1]['n_folds'] if records else 1
+        grouped = {}
+        for record in records:
+            if record['n_folds'] != n_folds:
+                continue
+            if n_samples is not None and record['n_samples'] != n_samples:
+                continue
+            setting = (params_key(record['params']), record['n_samples'])
+            grouped.setdefault(setting, {})[record['fold']] = record
+        candidates, scores, fit_times, score_times = [], [], [], []
+        for folds in grouped.values():
+            if len(folds) < n_folds:
+                continue
+            ordered = [folds[k] for k in range(n_folds)]
+            candidates.append(ordered[0]['params'])
+            scores.append([record['score'] for record in ordered])
+            fit_times.append([record['fit_time'] for record in ordered])
+            score_times.append([record['score_time'] for record in ordered])
+        shape = (len(candidates), n_folds)
+        return cv_results(candidates, np.array(scores, dtype=float).reshape(shape),
+                          np.array(fit_times, dtype=float).reshape(shape),
+                          np.array(score_times, dtype=float).reshape(shape))
+
+
+def cv_results(candidates, scores, fit_times, score_times):
+    """Builds a dict in the format of RandomizedSearchCV.cv_results_ from (candidates x folds) arrays."""
+
+    results = {
+        'mean_fit_time': fit_times.mean(axis=1),
+        'std_fit_time': fit_times.std(axis=1),
+        'mean_score_time': score_times.mean(axis=1),
+        'std_score_time': score_times.std(axis=1),
+    }
+    for name in sorted({name for params in candidates for name in params}):
+        results['param_' + name] = np.ma.masked_array([params.get(name) for params in candidates],
+                                                      mask=[name not in params for params in candidates],
+                                                      dtype=object)
+    results['params'] = candidates
+    for k in range(scores.shape[1]):
+        results['split{}_test_score'.format(k)] = scores[:, k]
+    results['mean_test_score'] = scores.mean(axis=1)
+    results['std_test_score'] = scores.std(axis=1)
+    # rank 1 is the best score, ties share the smallest rank, nan scores are ranked last
+    neg_scores = np.nan_to_num(-results['mean_test_score'], nan=np.inf)
+    results['rank_test_score'] = np.searchsorted(np.sort(neg_scores), neg_scores) + 1
+    return results
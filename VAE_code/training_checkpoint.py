@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""Periodic checkpoints of a VAE training run, for resuming a killed job where it stopped.
+
+A checkpoint holds the model weights, the optimizer state (step counter and AMSGrad slots), the number of finished
+epochs and the run id of the training log (see training_log.py), so a resumed run continues the rows of its log. No
+random state is stored: the Dropout/Sampling noise and the tf.data shuffle order are drawn from op seeds which start
+over in a new process, thus a resumed run is not bit-identical to an uninterrupted one.
+
+Checkpoints are written with tf.train.CheckpointManager, which only points to a checkpoint after all of its files are
+written, thus a job killed during a write resumes from the previous one. With async_write=True the files are written
+in a background thread while training continues.
+
+Usage:
+    checkpoint = TrainingCheckpoint(vae, 'checkpoints')
+    initial_epoch = checkpoint.restore()
+    vae.fit(..., epochs=epochs, initial_epoch=initial_epoch,
+            callbacks=[EpochLogger('training_log.csv', run=checkpoint.run_id), checkpoint])
+"""
+import time
+
+import tensorflow as tf
+from tensorflow import keras
+
+
+class TrainingCheckpoint(keras.callbacks.Callback):
+    """Saves a checkpoint every save_freq epochs (and at the end of fit), keeps the last max_to_keep of them.
+
+    run is the run id of a new run (default: its start time), restore replaces it by the one of the checkpoint.
+    """
+
+    def __init__(self, model, directory, save_freq=1, max_to_keep=2, async_write=True, run=None):
+        super(TrainingCheckpoint, self).__init__()
+        self.directory = directory
+        self.save_freq = save_freq
+        self.epoch = tf.Variable(0, dtype=tf.int64, trainable=False, name='epoch')
+        self.run = tf.Variable(run or time.strftime('%Y%m%d-%H%M%S'), dtype=tf.string, trainable=False, name='run')
+        self.checkpoint = tf.train.Checkpoint(model=model, optimizer=model.optimizer, epoch=self.epoch, run=self.run)
+        self.manager = tf.train.CheckpointManager(self.checkpoint, directory, max_to_keep=max_to_keep)
+        self.options = tf.train.CheckpointOptions(enable_async=async_write)
+        self._optimizer = model.optimizer
+        self._trainable_variables = model.trainable_variables
+
+    @property
+    def run_id(self):
+        """Run id for EpochLogger, call restore first to get the one of a resumed run."""
+
+        return self.run.numpy().decode()
+
+    def restore(self):
+        """Restores the latest checkpoint (if any) and returns the number of finished epochs, i.e. initial_epoch."""
+
+        if self.manager.latest_checkpoint is None:
+            return 0
+        # create the optimizer slots, thus they are restored now instead of being reinitialized at the first step
+        self._optimizer.build(self._trainable_variables)
+        self.checkpoint.restore(self.manager.latest_checkpoint).assert_existing_objects_matched()
+        return int(self.epoch.numpy())
+
+    def save(self, epochs_done):
+        """Writes a checkpoint after epochs_done finished epochs."""
+
+        self.epoch.assign(epochs_done)
+        self.manager.save(checkpoint_number=epochs_done, options=self.options)
+
+    def on_epoch_end(self, epoch, logs=None):
+        self._epochs_done = epoch + 1
+        if self._epochs_done % self.save_freq == 0:
+            self.save(self._epochs_done)
+
+    def on_train_end(self, logs=None):
+        # also keep the epochs since the last periodic checkpoint
+        if getattr(self, '_epochs_done', 0) > int(self.epoch.numpy()):
+            self.save(self._epochs_done)
+        # wait for a pending asynchronous write
+        self.checkpoint.sync()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""Per-epoch training log which is written while fit runs.
+
+EpochLogger appends one CSV row per epoch (and flushes it to disk), so a crashed or interrupted run keeps its history
+up to the last finished epoch. Every row carries a run id, thus several runs can share one log and be compared, e.g.
+by their throughput.
+"""
+import csv
+import os
+import time
+
+import pandas as pd
+from tensorflow import keras
+
+LOG_COLUMNS = ['run', 'epoch', 'loss', 'reconstruction_loss', 'kl_loss', 'val_loss', 'epoch_time', 'samples_per_s']
+
+
+class EpochLogger(keras.callbacks.Callback):
+    """Appends loss, reconstruction_loss, kl_loss, val_loss, epoch wall time and samples/s of every epoch to path.
+
+    n_samples is the number of training samples per epoch, needed for samples/s (left empty if None). run defaults to
+    the start time of the run.
+    """
+
+    def __init__(self, path, n_samples=None, run=None):
+        super(EpochLogger, self).__init__()
+        self.path = path
+        self.n_samples = n_samples
+        self.run = run or time.strftime('%Y%m%d-%H%M%S')
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch_start = time.time()
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        epoch_time = time.time() - self._epoch_start
+        row = {'run': self.run, 'epoch': epoch + 1, 'epoch_time': epoch_time,
+               'samples_per_s': self.n_samples / epoch_time if self.n_samples else ''}
+        for name in ['loss', 'reconstruction_loss', 'kl_loss', 'val_loss']:
+            row[name] = float(logs[name]) if name in logs else ''
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        write_header = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        with open(self.path, 'a', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=LOG_COLUMNS)
+            if write_header:
+                writer.writeheader()
+            writer.writerow(row)
+            file.flush()
+            os.fsync(file.fileno())
+
+
+def read_training_log(path, run=None):
+    """Reads the log into a DataFrame, only the rows of run if given (use 'last' for the most recent run).
+
+    A run resumed from a checkpoint logs the epochs after the checkpoint again, only the last row of every (run, epoch)
+    is kept.
+    """
+
+    log = pd.read_csv(path)
+    log = log.drop_duplicates(subset=['run', 'epoch'], keep='last')
+    if run == 'last':
+        run = log['run'].iloc[-1]
+    if run is not None:
+        log = log[log['run'] == run].reset_index(drop=True)
+    return log
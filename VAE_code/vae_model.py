@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+"""Model definition of the ECG5000 VAE: Sampling layer, encoder, decoder, VAE model and create_model.
+
+Kept in its own module so that the training script, the hyperparameter search workers and the tools around the
+trained model import the same definition.
+"""
+import contextlib
+import os
+
+import tensorflow as tf
+from tensorflow import keras
+from tensorflow.keras import layers
+from tensorflow.keras.layers import LSTM, Dense, TimeDistributed, Bidirectional, Dropout, Reshape, RepeatVector, \
+    Conv1D, Conv1DTranspose, Add, Flatten, GlobalAveragePooling1D
+from tensorflow.keras.regularizers import l2
+from tensorflow.keras.optimizers import SGD, Adam
+
+
+################
+### Sampling ###
+################
+
+
+class Sampling(layers.Layer):
+    """Uses (z_mean, z_log_var) to sample z"""
+
+    def call(self, inputs, **kwargs):
+        z_mean, z_log_var = inputs
+        batch = tf.shape(z_mean)[0]
+        dim = tf.shape(z_mean)[1]
+        epsilon = tf.keras.backend.random_normal(shape=(batch, dim))
+        return z_mean + tf.exp(0.5 * z_log_var) * epsilon
+
+
+###############
+### Encoder ###
+###############
+
+
+def create_encoder(intermediate_dim=140, latent_dim=5, dropout_rate=0.2, regularizer_rate=0.004, encoder_type='lstm'):
+    """Maps ECG5000 time series to a triplet (z_mean, z_log_var, z).
+
+    encoder_type selects the architecture, all of them run over all time steps in parallel except 'lstm':
+        'lstm' -- Bi-LSTM with intermediate_dim units (original encoder)
+        'tcn'  -- residual stack of causal Conv1D layers with dilations 1..64 (receptive field > 140 time steps),
+                  averaged over time
+        'conv' -- three Conv1D layers with stride 2 (140 -> 18 time steps), flattened
+    """
+
+    ### Define Layers
+    encoder_inputs = keras.Input(shape=(140, 1), name='Encoder_Input_layer')
+
+    if encoder_type == 'lstm':
+        encoded = Bidirectional(LSTM(intermediate_dim, activation='tanh', name=''), name='Encode_1')(encoder_inputs)
+        # encoded = Flatten()(encoded), LSTM return_sequence=True
+    elif encoder_type == 'tcn':
+        encoded = Conv1D(32, 1, name='Encode_1')(encoder_inputs)
+        for dilation_rate in (1, 2, 4, 8, 16, 32, 64):
+            block = Conv1D(32, 3, dilation_rate=dilation_rate, padding='causal', activation='relu',
+                           name='Encode_1_dilation_{}'.format(dilation_rate))(encoded)
+            encoded = Add(name='Encode_1_residual_{}'.format(dilation_rate))([encoded, block])
+        encoded = GlobalAveragePooling1D(name='Encode_1_pooling')(encoded)
+    elif encoder_type == 'conv':
+        encoded = Conv1D(32, 5, strides=2, padding='same', activation='relu', name='Encode_1')(encoder_inputs)
+        encoded = Conv1D(64, 5, strides=2, padding='same', activation='relu', name='Encode_1_2')(encoded)
+        encoded = Conv1D(64, 5, strides=2, padding='same', activation='relu', name='Encode_1_3')(encoded)
+        encoded = Flatten(name='Encode_1_flatten')(encoded)
+    else:
+        raise ValueError("Unknown encoder_type: {}".format(encoder_type))
+    encoded = Dropout(dropout_rate, name='Dropout_1')(encoded)
+    encoded = Dense(latent_dim, activation='tanh', name='Encode_2', kernel_regularizer=l2(regularizer_rate),
+                    activity_regularizer=l2(regularizer_rate))(encoded)
+
+    # latent layers always compute in float32, thus exp(z_log_var) in Sampling and the KL term stay stable under a
+    # mixed precision policy
+    z_mean = Dense(latent_dim, activation='softplus', name="z_mean", dtype='float32')(encoded)
+    z_log_var = Dense(latent_dim, activation='softplus', name="z_log_var", dtype='float32')(encoded)
+    z = Sampling(name='Sample_layer', dtype='float32')([z_mean, z_log_var])
+
+    ### Instantiate encoder
+    encoder = keras.Model(encoder_inputs, [z_mean, z_log_var, z], name="encoder")
+
+    return encoder
+
+
+# ### Check if encoder works
+# encoder_test = create_encoder()
+# encoder_test.summary()
+
+###############
+### Decoder ###
+###############
+
+
+def create_decoder(encoding_dim=140, intermediate_dim=140, latent_dim=5, dropout_rate=0.2,
+                   regularizer_rate=0.004, decoder_type='dense'):
+    """Converts z, the encoded time series, back into a readable time series.
+
+    decoder_type selects the architecture:
+        'dense'  -- Dense(encoding_dim * 256) reshaped to (140, 256) followed by a Bi-LSTM (original decoder)
+        'repeat' -- small Dense, RepeatVector over the time steps and one narrow LSTM (intermediate_dim // 4 units)
+        'conv'   -- small Dense reshaped to (35, 32) and upsampled by two strided Conv1DTranspose layers
+    """
+
+    ### Define Layers
+    latent_inputs = keras.Input(shape=(latent_dim,), name='Decoder_Input_layer')
+
+    if decoder_type == 'dense':
+        decoded = Dense(encoding_dim * 256, activation='tanh', name='Decode_1',
+                        kernel_regularizer=l2(regularizer_rate), activity_regularizer=l2(regularizer_rate))(
+            latent_inputs)
+        decoded = Reshape((140, 256), name='Decode_2')(decoded)
+        decoded = Dropout(dropout_rate, name='Dropout_1')(decoded)
+        decoded = Bidirectional(LSTM(intermediate_dim, activation='tanh', return_sequences=True, name=''),
+                                name='Decode_3')(decoded)
+    elif decoder_type == 'repeat':
+        decoded = Dense(64, activation='tanh', name='Decode_1', kernel_regularizer=l2(regularizer_rate),
+                        activity_regularizer=l2(regularizer_rate))(latent_inputs)
+        decoded = RepeatVector(encoding_dim, name='Decode_2')(decoded)
+        decoded = Dropout(dropout_rate, name='Dropout_1')(decoded)
+        decoded = LSTM(max(intermediate_dim // 4, 1), activation='tanh', return_sequences=True, name='Decode_3')(
+            decoded)
+    elif decoder_type == 'conv':
+        decoded = Dense((encoding_dim // 4) * 32, activation='tanh', name='Decode_1',
+                        kernel_regularizer=l2(regularizer_rate), activity_regularizer=l2(regularizer_rate))(
+            latent_inputs)
+        decoded = Reshape((encoding_dim // 4, 32), name='Decode_2')(decoded)
+        decoded = Dropout(dropout_rate, name='Dropout_1')(decoded)
+        decoded = Conv1DTranspose(32, 5, strides=2, padding='same', activation='tanh', name='Decode_3')(decoded)
+        decoded = Conv1DTranspose(16, 5, strides=2, padding='same', activation='tanh', name='Decode_4')(decoded)
+        decoded = Conv1D(16, 5, padding='same', activation='tanh', name='Decode_5')(decoded)
+    else:
+        raise ValueError("Unknown decoder_type: {}".format(decoder_type))
+
+    # output in float32, thus the reconstruction loss is computed in float32 under a mixed precision policy
+    decoder_outputs = TimeDistributed(Dense(1, activation='linear', name='', dtype='float32'),
+                                      name='Decoder_Output_Layer', dtype='float32')(decoded)
+
+    ### Instantiate decoder
+    decoder = keras.Model(latent_inputs, decoder_outputs, name="decoder")
+
+    return decoder
+
+
+# ### Check if decoder works
+# decoder_test = create_decoder()
+# decoder_test.summary()
+
+###########
+### VAE ###
+###########
+
+
+class VAE(keras.Model):
+    """Combines the encoder and decoder into an end-to-end model for training."""
+
+    def __init__(self, encoder, decoder, deterministic_eval=False, **kwargs):
+        super(VAE, self).__init__(**kwargs)
+        self.encoder = encoder
+        self.decoder = decoder
+        # decode z_mean instead of a sample of z in test_step, gives a noise free validation loss
+        self.deterministic_eval = deterministic_eval
+        # averages of the losses over all batches of one epoch/evaluation, over all replicas under a distribution
+        # strategy (the metric variables are summed across replicas)
+        self.loss_tracker = keras.metrics.Mean(name="loss")
+        self.reconstruction_loss_tracker = keras.metrics.Mean(name="reconstruction_loss")
+        self.kl_loss_tracker = keras.metrics.Mean(name="kl_loss")
+
+    @property
+    def metrics(self):
+        # listed here so that fit/evaluate reset them at the start of every epoch/evaluation
+        return [self.loss_tracker, self.reconstruction_loss_tracker, self.kl_loss_tracker]
+
+    @staticmethod
+    def compute_losses(data, reconstruction, z_mean, z_log_var):
+        """Returns (total_loss, reconstruction_loss, kl_loss), each reduced in one op so XLA can fuse them."""
+
+        # accumulate the losses in float32, also if the model computes in bfloat16
+        reconstruction = tf.cast(reconstruction, tf.float32)
+        z_mean = tf.cast(z_mean, tf.float32)
+        z_log_var = tf.cast(z_log_var, tf.float32)
+        # mean over samples of the per sample MSE * 140 == mean over all elements * 140
+        reconstruction_loss = tf.reduce_mean(tf.math.squared_difference(data, reconstruction)) * 140
+        kl_loss = -0.5 * tf.reduce_mean(1 + z_log_var - tf.square(z_mean) - tf.exp(z_log_var))
+        return reconstruction_loss + kl_loss, reconstruction_loss, kl_loss
+
+    def train_step(self, data):
+        # unpack the data
+        if isinstance(data, tuple):
+            data = data[0]
+        with tf.GradientTape() as tape:
+            # forward pass
+            z_mean, z_log_var, z = self.encoder(data)
+            reconstruction = self.decoder(z)
+            # Compute own loss
+            total_loss, reconstruction_loss, kl_loss = self.compute_losses(data, reconstruction, z_mean, z_log_var)
+            # under a distribution strategy the gradients of the replicas are summed, thus each replica scales its
+            # loss by its share of the global batch (scale 1 without a strategy)
+            batch_size = tf.cast(tf.shape(data)[0], tf.float32)
+            global_batch_size = tf.distribute.get_replica_context().all_reduce(tf.distribute.ReduceOp.SUM, batch_size)
+            scaled_loss = total_loss * batch_size / global_batch_size
+        # compute gradients
+        grads = tape.gradient(scaled_loss, self.trainable_weights)
+        # update weights
+        self.optimizer.apply_gradients(zip(grads, self.trainable_weights))
+        # compute own metrics, averaged over the global batch and all batches of the epoch
+        self.loss_tracker.update_state(total_loss, sample_weight=batch_size)
+        self.reconstruction_loss_tracker.update_state(reconstruction_loss, sample_weight=batch_size)
+        self.kl_loss_tracker.update_state(kl_loss, sample_weight=batch_size)
+        return {m.name: m.result() for m in self.metrics}
+
+    def test_step(self, data):
+        # unpack the data, the input is the target
+        if isinstance(data, tuple):
+            data = data[0]
+        # forward pass in inference mode (no dropout), the losses are the same as in train_step
+        z_mean, z_log_var, z = self.encoder(data, training=False)
+        reconstruction = self.decoder(z_mean if self.deterministic_eval else z, training=False)
+        total_loss, reconstruction_loss, kl_loss = self.compute_losses(data, reconstruction, z_mean, z_log_var)
+        # average over all validation batches, weighted by the batch size
+        batch_size = tf.shape(data)[0]
+        self.loss_tracker.update_state(total_loss, sample_weight=batch_size)
+        self.reconstruction_loss_tracker.update_state(reconstruction_loss, sample_weight=batch_size)
+        self.kl_loss_tracker.update_state(kl_loss, sample_weight=batch_size)
+        return {m.name: m.result() for m in self.metrics}
+
+    def call(self, data, **kwargs):
+        z_mean, z_log_var, z = self.encoder(data)
+        reconstructed = self.decoder(z)
+        return reconstructed
+
+    def encode(self, x, batch_size=None, deterministic=False, verbose=0):
+        """Runs the encoder once over x and returns (z_mean, z_log_var, z), with z = z_mean if deterministic.
+
+        batch_size and verbose are passed to predict, batch_size must be None if x is a Sequence or tf.data.Dataset
+        (batched already).
+        """
+
+        z_mean, z_log_var, z = self.encoder.predict(x, batch_size=batch_size, verbose=verbose)
+        if deterministic:
+            z = z_mean
+        return z_mean, z_log_var, z
+
+    def reconstruct(self, x, batch_size=None, deterministic=False, verbose=0):
+        """Runs encoder and decoder once over x and returns the reconstruction."""
+
+        _, _, z = self.encode(x, batch_size=batch_size, deterministic=deterministic, verbose=verbose)
+        return self.decoder.predict(z, batch_size=batch_size, verbose=verbose)
+
+    def profile_layers(self, x, batch_size=16, n_steps=5):
+        """Per layer forward/backward time and activation memory of n_steps training steps, see layer_profiler."""
+
+        from layer_profiler import profile_layers
+        return profile_layers(self, x, batch_size=batch_size, n_steps=n_steps)
+
+
+################################################
+### Build VAE connecting Encoder and Decoder ###
+################################################
+
+# built models of create_model(cache=True) by structural hyperparameters
+_model_cache = {}
+
+
+def _set_regularization(model, dropout_rate, regularizer_rate):
+    """Sets the rate of all Dropout layers and the l2 factor of all regularizers of encoder and decoder."""
+
+    for layer in model.encoder.layers + model.decoder.layers:
+        if isinstance(layer, Dropout):
+            layer.rate = dropout_rate
+        for regularizer in (getattr(layer, 'kernel_regularizer', None), getattr(layer, 'activity_regularizer', None)):
+            if regularizer is not None and hasattr(regularizer, 'l2'):
+                regularizer.l2 = float(regularizer_rate)
+
+
+def _reuse_model(entry, dropout_rate, regularizer_rate, learn_rate):
+    """Resets a cached model to its initial weights and a fresh optimizer state and applies the other parameters."""
+
+    model = entry['model']
+    model.set_weights(entry['initial_weights'])
+    for variable in model.optimizer.variables:
+        variable.assign(tf.zeros_like(variable))
+    model.optimizer.learning_rate = learn_rate
+    if (dropout_rate, regularizer_rate) != (entry['dropout_rate'], entry['regularizer_rate']):
+        _set_regularization(model, dropout_rate, regularizer_rate)
+        entry['dropout_rate'], entry['regularizer_rate'] = dropout_rate, regularizer_rate
+        # the rates are constants of the traced functions, thus those have to be traced again
+        model.make_train_function(force=True)
+        model.make_test_function(force=True)
+        model.make_predict_function(force=True)
+    model.stop_training = False
+    return model
+
+
+### Define function to create model
+def create_model(intermediate_dim=140, dropout_rate=0.2, regularizer_rate=0.004, optimizer='adam', learn_rate=0.001,
+                 name='VAE', jit_compile=False, steps_per_execution=1, precision='float32', decoder_type='dense',
+                 encoder_type='lstm', deterministic_eval=False, strategy=None, cache=False):
+    """Creates VAE model, required for wrapping in estimator interface KerasRegressor, while accepting the hyperparameters we want to tune. We also pass some default values.
+
+    jit_compile=True compiles train and test step with XLA, steps_per_execution runs that many batches per call of the
+    compiled function, which removes the per batch Python dispatch overhead for small batch sizes.
+
+    precision='mixed_bfloat16' computes the LSTMs and dense layers in bfloat16 while keeping float32 weights, the
+    latent layers, the decoder output and the losses stay in float32.
+
+    encoder_type and decoder_type select the encoder and decoder architecture, see create_encoder and create_decoder.
+
+    deterministic_eval=True decodes z_mean instead of a sample of z during evaluation, see VAE.test_step.
+
+    strategy (e.g. tf.distribute.MultiWorkerMirroredStrategy) creates the variables under its scope, thus fit trains
+    data parallel with the global batch split over the replicas, see distributed_training.py.
+
+    cache=True reuses the model built by an earlier call with the same structural parameters (all except dropout_rate,
+    regularizer_rate and learn_rate): its weights are reset to the initial weights of that first build, the optimizer
+    state to zero and the other parameters are reapplied, the traced train function is kept if the rates did not
+    change. The returned model is then the same object as before, thus only one model per structure can be in use at a
+    time (e.g. sequential candidates of a search, not the rungs of SuccessiveHalvingSearch)."""
+
+    key = (intermediate_dim, optimizer, name, jit_compile, steps_per_execution, precision, decoder_type, encoder_type,
+           deterministic_eval)
+    # models of a distribution strategy are bound to it, they are never cached
+    cache = cache and strategy is None
+    if cache and key in _model_cache:
+        return _reuse_model(_model_cache[key], dropout_rate, regularizer_rate, learn_rate)
+
+    scope = strategy.scope() if strategy is not None else contextlib.nullcontext()
+    with scope:
+        # the precision policy only applies to the layers created here, the global policy is restored afterwards
+        previous_policy = keras.mixed_precision.global_policy()
+        keras.mixed_precision.set_global_policy(precision)
+        try:
+            # create encoder
+            encoder = create_encoder(intermediate_dim=intermediate_dim, dropout_rate=dropout_rate,
+                                     regularizer_rate=regularizer_rate, encoder_type=encoder_type)
+            # create decoder
+            decoder = create_decoder(intermediate_dim=intermediate_dim, dropout_rate=dropout_rate,
+                                     regularizer_rate=regularizer_rate, decoder_type=decoder_type)
+        finally:
+            keras.mixed_precision.set_global_policy(previous_policy)
+        # create vae
+        model = VAE(encoder, decoder, deterministic_eval=deterministic_eval, name=name)
+        # compile model
+        if optimizer == 'adam':
+            opt = Adam(learning_rate=learn_rate, amsgrad=True)
+        else:
+            opt = SGD(learning_rate=learn_rate)
+        model.compile(optimizer=opt, jit_compile=jit_compile, steps_per_execution=steps_per_execution)
+        model.build((None, 140, 1))
+
+    if cache:
+        _model_cache[key] = {'model': model, 'initial_weights': model.get_weights(), 'dropout_rate': dropout_rate,
+                             'regularizer_rate': regularizer_rate}
+    return model
+
+
+#####################################
+### Save and Load Encoder/Decoder ###
+#####################################
+
+
+def save_vae(model, directory):
+    """Saves encoder and decoder of a trained VAE as SavedModels into directory/encoder and directory/decoder."""
+
+    os.makedirs(directory, exist_ok=True)
+    model.encoder.save(os.path.join(directory, 'encoder'), save_format='tf')
+    model.decoder.save(os.path.join(directory, 'decoder'), save_format='tf')
+
+
+def load_vae(directory):
+    """Loads (encoder, decoder) saved by save_vae, for inference only (not compiled)."""
+
+    custom_objects = {'Sampling': Sampling}
+    encoder = keras.models.load_model(os.path.join(directory, 'encoder'), custom_objects=custom_objects,
+                                      compile=False)
+    decoder = keras.models.load_model(os.path.join(directory, 'decoder'), custom_objects=custom_objects,
+                                      compile=False)
+    return encoder, decoder